@@ -0,0 +1,105 @@
+import random
+import env
+import env_noOctave
+import env_randtrans
+
+# Checks beat_groups/enter_group of the env modules against the while-loop beat scan that step and
+# reset used before (kept below as scan_beat). Random actions are replayed over synthetic pieces, so
+# neither the corpus nor music21 is needed: the envs' load_corpus is swapped for a lookup.
+
+note_names = ["C", "C#", "D", "E-", "E", "F", "F#", "G", "A-", "A", "B-", "B"]
+
+
+def random_piece(rng):
+    n = rng.randint(1, 40)
+    # beats count within a 4/4 bar, so the same whole beat can follow itself across a barline
+    beat = []
+    offset = []
+    position = 0.0
+    for _ in range(n):
+        beat.append(position % 4 + 1)
+        offset.append(position)
+        position += rng.choice([0, 0, 0.25, 0.5, 1, 1.5, 2, 4])
+    notes = [rng.choice(note_names) for _ in range(n)]
+    duration = [rng.choice([0.25, 0.5, 1.0]) for _ in range(n)]
+    octave = [rng.randint(2, 6) for _ in range(n)]
+    is_segment = [rng.random() < 0.2 for _ in range(n)]
+    return notes, offset, beat, duration, octave, is_segment
+
+
+def scan_beat(beat, is_segment, first):
+    # the old loop: the latest beat is the run of notes from `first` on the same whole beat
+    is_correct = bool(is_segment[first])
+    currentbeat = beat[first] // 1
+    currentindex = first + 1
+    while len(beat) > currentindex and beat[currentindex] // 1 == currentbeat:
+        if is_segment[currentindex]:
+            is_correct = True
+        currentindex += 1
+    return is_correct, currentindex
+
+
+def expected_state(beat, is_segment, first, next_beat):
+    is_correct, last = scan_beat(beat, is_segment, first)
+    state = {
+        "isCorrectSegment": is_correct,
+        "latestbeatfirst": first,
+        "latestbeatlast": last,
+        "notelistlast": last,
+    }
+    if next_beat is not None:
+        state["nextbeatfirst"] = last
+        # the old test 'len(beat) >= currentindex' always held, so the next beat window was empty
+        state["nextbeatlast"] = last
+        if next_beat and last < len(beat):
+            state["nextbeatlast"] = scan_beat(beat, is_segment, last)[1]
+    return state
+
+
+def check(module, pieces, next_beat, rng):
+    corpus = dict(pieces)
+    module.load_corpus = lambda names, **kwargs: [corpus[name] for name in names]
+    if next_beat is None:
+        environment = module.SegmentationEnv(list(corpus))
+    else:
+        environment = module.SegmentationEnv(list(corpus), next_beat=next_beat)
+    steps = 0
+    for idx in range(len(environment.notes)):
+        beat, is_segment = environment.beat[idx], environment.is_segment[idx]
+        environment.reset(idx)
+        first = 0
+        while True:
+            for name, value in expected_state(
+                beat, is_segment, first, next_beat
+            ).items():
+                assert getattr(environment, name) == value, (
+                    module.__name__,
+                    idx,
+                    first,
+                    name,
+                    getattr(environment, name),
+                    value,
+                )
+            first = environment.latestbeatlast
+            obs, reward, done, info = environment.step(rng.randint(0, 1))
+            steps += 1
+            if done:
+                break
+            assert environment.current_noteoffset == environment.offset[idx][first]
+            if next_beat is False:
+                assert not obs[12:24].any(), (module.__name__, idx, first)
+    return steps
+
+
+rng = random.Random(0)
+pieces = [("piece%d" % i, random_piece(rng)) for i in range(300)]
+for module, options in [
+    (env, [None]),
+    (env_noOctave, [False, True]),
+    (env_randtrans, [False, True]),
+]:
+    for next_beat in options:
+        steps = check(module, pieces, next_beat, rng)
+        print(module.__name__, "next_beat=%s" % next_beat, steps, "steps match")
+
+print("Done!")
@@ -1,26 +1,37 @@
 from gym import Env
 from gym.spaces import Discrete, Box
-import math
-from itertools import combinations
 from datetime import datetime
-from music21 import *
 import numpy as np
-from m21preprocess import preprocessing
+from roughness import RoughnessWindow, spelled_codes
+from piece_cache import (
+    beat_groups,
+    load_corpus,
+    octave_array,
+    octave_weight,
+    pitch_classes,
+)
 
 
 class SegmentationEnv(Env):
-    def __init__(self, pieces):
+    def __init__(self, pieces, processes=1, next_beat=False):
+        # next_beat: observe the chroma of the beat after the latest one. The shipped models were
+        # trained with that row always empty (the old scan loop never filled it), so only new ones set it
+        self.next_beat = next_beat
         # Preprocess the pieces
         self.notes = []
         self.offset = []
         self.beat = []
         self.duration = []
         self.octave = []
+        self.pitch = []
+        self.codes = []
+        self.groups = []
         self.is_segment = []
         self.piecelist = []
         #         self.beatchanges = []
-        for piece in pieces:
-            getlist = preprocessing(piece)
+        pieces = list(pieces)
+        corpus = load_corpus(pieces, processes=processes)
+        for piece, getlist in zip(pieces, corpus):
             if getlist is None:
                 continue
             xnotes, xoffset, xbeat, xduration, xoctave, xissegment = getlist
@@ -28,9 +39,12 @@ class SegmentationEnv(Env):
             self.notes.append(xnotes)
             self.offset.append(xoffset)
             self.beat.append(xbeat)
-            self.duration.append(xduration)
-            self.octave.append(xoctave)
+            self.duration.append(np.array(xduration, dtype=np.float64))
+            self.octave.append(octave_array(xoctave))
+            self.pitch.append(pitch_classes(xnotes))
+            self.codes.append(spelled_codes(xnotes, xoctave))
             self.is_segment.append(xissegment)
+            self.groups.append(beat_groups(xbeat, xissegment))
 
         # Actions: Remain segment (0), segment (1)
         self.action_space = Discrete(2)
@@ -50,7 +64,9 @@ class SegmentationEnv(Env):
         self.latestbeatlast = 0
         self.nextbeatfirst = 0
         self.nextbeatlast = 0
+        self.current_group = 0
         self.isCorrectSegment = False
+        self.roughness_window = None
         # self.state = np.zeros((12,7))
 
         # save segmentation for rendering purposes
@@ -96,39 +112,27 @@ class SegmentationEnv(Env):
             #     self.latestbeatfirst = 0
             #     self.latestbeatlast = 0
         if not done:
-            self.isCorrectSegment = False
-            if self.is_segment[self.current_piece][self.latestbeatlast]:
-                self.isCorrectSegment = True
             self.current_noteoffset = self.offset[self.current_piece][
                 self.latestbeatlast
             ]
-            currentbeat = self.beat[self.current_piece][self.latestbeatlast] // 1
-            currentindex = self.latestbeatlast + 1
-            self.latestbeatfirst = self.latestbeatlast
-            while (
-                len(self.beat[self.current_piece]) > currentindex
-                and self.beat[self.current_piece][currentindex] // 1 == currentbeat
-            ):
-                if self.is_segment[self.current_piece][currentindex]:
-                    self.isCorrectSegment = True
-                currentindex += 1
-            self.notelistlast = currentindex
-            self.latestbeatlast = currentindex
-            self.nextbeatfirst = currentindex
-            if len(self.beat[self.current_piece]) >= currentindex:
-                self.nextbeatlast = currentindex
-            else:
-                currentbeat = self.beat[self.current_piece][currentindex] // 1
-                currentindex = currentindex + 1
-                while (
-                    len(self.beat[self.current_piece]) > currentindex
-                    and self.beat[self.current_piece][currentindex] // 1 == currentbeat
-                ):
-                    currentindex += 1
-                self.nextbeatlast = currentindex
+            self.enter_group(self.current_group + 1)
         info = {}
         return self.staterender(done), reward, done, info
 
+    def enter_group(self, group):
+        # make beat group `group` the latest beat, and (with next_beat) the group after it the next beat
+        starts, ends, has_segment = self.groups[self.current_piece]
+        self.current_group = group
+        self.isCorrectSegment = has_segment[group]
+        self.latestbeatfirst = starts[group]
+        self.latestbeatlast = ends[group]
+        self.notelistlast = ends[group]
+        self.nextbeatfirst = ends[group]
+        if self.next_beat and group + 1 < len(ends):
+            self.nextbeatlast = ends[group + 1]
+        else:
+            self.nextbeatlast = ends[group]
+
     def render(self):
         # print("Current piece:",self.current_piece)
         print("Current notelist:", self.notelistfirst, self.notelistlast)
@@ -137,131 +141,49 @@ class SegmentationEnv(Env):
         return
 
     def change_in_roughness(self):
-        def roughness(notes):
-            """
-            Calculate the Roughness of notes according to sum of ideal ratio N+M
-            Reference: https://www.researchgate.net/publication/276905584_Measuring_Musical_Consonance_and_Dissonance
-            """
-
-            def interval_to_ratio(interval):
-                interval_ratio_mapping = {
-                    0: 1 + 1,
-                    1: 18 + 17,
-                    2: 9 + 8,
-                    3: 6 + 5,
-                    4: 5 + 4,
-                    5: 4 + 3,
-                    6: 17 + 12,
-                    7: 3 + 2,
-                    8: 8 + 5,
-                    9: 5 + 3,
-                    10: 16 + 9,
-                    11: 17 + 9,
-                }
-                interval_pitch_mapping = {
-                    1: 0,
-                    2: 2,
-                    3: 4,
-                    4: 5,
-                    5: 7,
-                    6: 9,
-                    7: 11,
-                    8: 12,
-                }
-                ans = interval_pitch_mapping[int(interval[-1])]
-                if int(interval[-1]) in [4, 5, 8]:
-                    intname = interval[:-1]
-                    if intname == "dd":
-                        ans -= 2
-                    elif intname == "d":
-                        ans -= 1
-                    elif intname == "A":
-                        ans += 1
-                    elif intname == "AA":
-                        ans += 2
-                else:
-                    intname = interval[:-1]
-                    if intname == "m":
-                        ans -= 1
-                    elif intname == "d":
-                        ans -= 2
-                    elif intname == "A":
-                        ans += 1
-                    elif intname == "AA":
-                        ans += 2
-                ans = ans % 12
-                return interval_ratio_mapping[ans]
-
-            ans = 0
-            for combo in combinations(notes, 2):
-                n1 = note.Note(combo[0])
-                n2 = note.Note(combo[1])
-                xinterval = interval.Interval(noteStart=n1, noteEnd=n2)
-                ans += interval_to_ratio(xinterval.semiSimpleName)
-            return ans / len(notes) if len(notes) != 0 else 0
+        # roughness of the current segment with the latest beat minus without it, see roughness.py.
+        # consecutive steps only add notes to the window, so it is extended instead of recomputed
+        codes = self.codes[self.current_piece]
+        window = self.roughness_window
+        if (
+            window is None
+            or window.codes is not codes
+            or window.first != self.notelistfirst
+            or window.last > self.latestbeatfirst
+        ):
+            window = self.roughness_window = RoughnessWindow(codes, self.notelistfirst)
+        window.extend(self.latestbeatfirst)
+        if window.count == 0:
+            return 0
+        before = window.roughness()
+        window.extend(self.latestbeatlast)
+        return window.roughness() - before
 
-        notelist1 = []
-        for i in range(self.notelistfirst, self.latestbeatfirst):
-            notelist1.append(
-                self.notes[self.current_piece][i]
-                + str(self.octave[self.current_piece][i])
-            )
-        notelist2 = notelist1.copy()
-        for i in range(self.latestbeatfirst, self.latestbeatlast):
-            notelist2.append(
-                self.notes[self.current_piece][i]
-                + str(self.octave[self.current_piece][i])
-            )
-        notelist1 = list(dict.fromkeys(notelist1))
-        notelist2 = list(dict.fromkeys(notelist2))
-        return roughness(notelist2) - roughness(notelist1) if len(notelist1) != 0 else 0
+    def beatchroma(self, pitch, octave, duration, first, last):
+        # octave weighted duration of notes first..last-1 per pitch class, capped at 30
+        pitch = pitch[first:last]
+        octave = octave[first:last]
+        inside = (octave >= 1) & (octave <= 7)
+        chroma = np.bincount(
+            pitch[inside],
+            weights=duration[first:last][inside] * octave_weight[octave[inside] - 1],
+            minlength=12,
+        )
+        return np.minimum(chroma, 30)
 
     def staterender(self, done):
-        pitch_to_index = {"C": 0, "D": 2, "E": 4, "F": 5, "G": 7, "A": 9, "B": 11}
-        octave_weight = [1.25, 1.25, 1.1, 1, 0.9, 0.8, 0.7]
         obsarray = np.zeros((2, 12))
         if done:
             return np.append(obsarray.flatten(), [0])
-        for idx in range(self.notelistfirst, self.notelistlast):
-            current_note = self.notes[self.current_piece][idx]
-            current_duration = self.duration[self.current_piece][idx]
-            current_octave = self.octave[self.current_piece][idx]
-            pitchindex = pitch_to_index[current_note[0]]
-            current_note = current_note[1:]
-            if current_note == "#":
-                pitchindex += 1
-            elif current_note == "##":
-                pitchindex += 2
-            elif current_note == "-":
-                pitchindex -= 1
-            elif current_note == "--":
-                pitchindex -= 2
-            pitchindex = pitchindex % 12
-            if current_octave < 1 or current_octave > 7:
-                continue
-            current_octave -= 1
-            obsarray[0][pitchindex] += current_duration * octave_weight[current_octave]
-            obsarray[0][pitchindex] = min(30, obsarray[0][pitchindex])
-        for idx in range(self.nextbeatfirst, self.nextbeatlast):
-            current_note = self.notes[self.current_piece][idx]
-            current_duration = self.duration[self.current_piece][idx]
-            current_octave = self.octave[self.current_piece][idx]
-            pitchindex = pitch_to_index[current_note[0]]
-            current_note = current_note[1:]
-            if current_note == "#":
-                pitchindex += 1
-            elif current_note == "##":
-                pitchindex += 2
-            elif current_note == "-":
-                pitchindex -= 1
-            elif current_note == "--":
-                pitchindex -= 2
-            pitchindex = pitchindex % 12
-            if current_octave < 1 or current_octave > 7:
-                continue
-            current_octave -= 1
-            obsarray[1][pitchindex] += current_duration * octave_weight[current_octave]
-            obsarray[1][pitchindex] = min(30, obsarray[1][pitchindex])
+        pitch = self.pitch[self.current_piece]
+        octave = self.octave[self.current_piece]
+        duration = self.duration[self.current_piece]
+        obsarray[0] = self.beatchroma(
+            pitch, octave, duration, self.notelistfirst, self.notelistlast
+        )
+        obsarray[1] = self.beatchroma(
+            pitch, octave, duration, self.nextbeatfirst, self.nextbeatlast
+        )
         obsarray = obsarray / 30
         return np.append(
             obsarray.flatten(), [min(max(self.change_in_roughness() / 20, 1), 0)]
@@ -274,31 +196,6 @@ class SegmentationEnv(Env):
         self.notelistlast = 0  # exclusive
         self.latestbeatfirst = 0
         self.latestbeatlast = 0  # exclusive
-        self.isCorrectSegment = False
-        if self.is_segment[self.current_piece][self.latestbeatlast]:
-            self.isCorrectSegment = True
-        currentbeat = self.beat[self.current_piece][self.latestbeatlast] // 1
-        currentindex = self.latestbeatlast + 1
-        while (
-            len(self.beat[self.current_piece]) > currentindex
-            and self.beat[self.current_piece][currentindex] // 1 == currentbeat
-        ):
-            if self.is_segment[self.current_piece][currentindex]:
-                self.isCorrectSegment = True
-            currentindex += 1
-        self.notelistlast = currentindex
-        self.latestbeatlast = currentindex
-        self.nextbeatfirst = currentindex
-        if len(self.beat[self.current_piece]) >= currentindex:
-            self.nextbeatlast = currentindex
-        else:
-            currentbeat = self.beat[self.current_piece][currentindex] // 1
-            currentindex = currentindex + 1
-            while (
-                len(self.beat[self.current_piece]) > currentindex
-                and self.beat[self.current_piece][currentindex] // 1 == currentbeat
-            ):
-                currentindex += 1
-            self.nextbeatlast = currentindex
+        self.enter_group(0)
 
         return self.staterender(False)
@@ -183,7 +183,11 @@ def key_transpose(piece):
     return c
 
 
-def preprocessing(piece, to_trans=True):
+def preprocessing(piece, to_trans=True, linked_only=True):
+    """
+        linked_only=False also keeps notes whose duration is not linked (env.py parses that way).
+        Bump piece_cache.PREPROCESS_VERSION when the output of this function changes.
+    """
     try:
         if to_trans:
             c = key_transpose(piece)
@@ -199,7 +203,7 @@ def preprocessing(piece, to_trans=True):
         print(piece)
         post = c.flattenParts().flat
         for note in post.notes:
-            if not note.duration.linked:
+            if linked_only and not note.duration.linked:
                 continue
             duration = note.duration.quarterLength
             offset = note.offset
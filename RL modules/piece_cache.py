@@ -0,0 +1,157 @@
+import hashlib
+import multiprocessing
+import os
+from functools import partial
+import numpy as np
+import tqdm
+
+# On-disk cache of m21preprocess.preprocessing results, one compressed .npz per piece.
+# Files are named after the sha256 of the piece file content, PREPROCESS_VERSION and the
+# preprocessing options, so an edited piece or a changed preprocessor simply misses the cache.
+# A hit only needs numpy: music21 (through m21preprocess) is imported on the first miss.
+#
+# Arrays of a cached piece, one entry per pitch:
+#   notes       <U    pitch name ("C", "F#", "B-", ...)
+#   offset      float64
+#   beat        float64
+#   duration    float64
+#   octave      int8      NO_OCTAVE for pitches without an octave
+#   is_segment  bool
+
+# bump whenever m21preprocess.preprocessing changes its output
+PREPROCESS_VERSION = 1
+NO_OCTAVE = -128
+cache_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "piece_cache")
+
+
+def cache_path(piece, to_trans=True, linked_only=True, root=cache_dir):
+    digest = hashlib.sha256()
+    with open(piece, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    digest.update(
+        (
+            "version=%d to_trans=%d linked_only=%d"
+            % (PREPROCESS_VERSION, to_trans, linked_only)
+        ).encode()
+    )
+    return os.path.join(root, digest.hexdigest() + ".npz")
+
+
+def save_piece(path, getlist):
+    xnotes, xoffset, xbeat, xduration, xoctave, xissegment = getlist
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # write to a temporary name first so a concurrent reader never sees half a file
+    temp_path = "%s.%d.tmp" % (path, os.getpid())
+    with open(temp_path, "wb") as f:
+        np.savez_compressed(
+            f,
+            notes=np.array(xnotes, dtype=str),
+            offset=np.array(xoffset, dtype=np.float64),
+            beat=np.array(xbeat, dtype=np.float64),
+            duration=np.array(xduration, dtype=np.float64),
+            octave=octave_array(xoctave),
+            is_segment=np.array(xissegment, dtype=bool),
+        )
+    os.replace(temp_path, path)
+
+
+def load_cached(path):
+    with np.load(path) as f:
+        return (
+            f["notes"].tolist(),
+            f["offset"].tolist(),
+            f["beat"].tolist(),
+            f["duration"].tolist(),
+            [None if o == NO_OCTAVE else o for o in f["octave"].tolist()],
+            f["is_segment"].tolist(),
+        )
+
+
+def load_piece(piece, to_trans=True, linked_only=True, root=cache_dir):
+    """
+        Same return value as m21preprocess.preprocessing (None when the piece fails to parse),
+        read from the cache when possible. Failures are not cached.
+        Offsets and durations come back as floats rather than music21 Fractions.
+    """
+    path = cache_path(piece, to_trans, linked_only, root)
+    if os.path.exists(path):
+        try:
+            return load_cached(path)
+        except Exception as e:
+            print("Ignoring unreadable cache file", path, str(e))
+    from m21preprocess import preprocessing
+
+    getlist = preprocessing(piece, to_trans, linked_only)
+    if getlist is None:
+        return None
+    save_piece(path, getlist)
+    # read back, so the first run sees exactly what later runs will
+    return load_cached(path)
+
+
+pitch_to_index = {"C": 0, "D": 2, "E": 4, "F": 5, "G": 7, "A": 9, "B": 11}
+accidental_shift = {"#": 1, "##": 2, "-": -1, "--": -2}
+# staterender octave weights for octaves 1-7, from low to high
+octave_weight = np.array([1.25, 1.25, 1.1, 1, 0.9, 0.8, 0.7])
+
+
+def pitch_classes(notes):
+    """
+        Pitch class (0-11) of every note name, int8. Other accidentals count as natural, as in staterender.
+    """
+    return np.array(
+        [
+            (pitch_to_index[name[0]] + accidental_shift.get(name[1:], 0)) % 12
+            for name in notes
+        ],
+        dtype=np.int8,
+    )
+
+
+def octave_array(octaves):
+    return np.array([NO_OCTAVE if o is None else o for o in octaves], dtype=np.int8)
+
+
+def beat_groups(beat, is_segment):
+    """
+        Runs of consecutive notes on the same whole beat (beat // 1), as lists: start index,
+        end index (exclusive) and whether any note of the run is a segment boundary.
+    """
+    if len(beat) == 0:
+        return [], [], []
+    whole = np.floor(np.asarray(beat, dtype=np.float64))
+    starts = np.flatnonzero(np.r_[True, whole[1:] != whole[:-1]])
+    ends = np.r_[starts[1:], len(whole)]
+    has_segment = np.logical_or.reduceat(np.asarray(is_segment, dtype=bool), starts)
+    return starts.tolist(), ends.tolist(), has_segment.tolist()
+
+
+def load_piece_safely(piece, to_trans=True, linked_only=True, root=cache_dir):
+    # preprocessing already returns None on a parse error, this also covers unreadable files
+    try:
+        return load_piece(piece, to_trans, linked_only, root)
+    except Exception as e:
+        print("Error in piece", piece, str(e))
+        return None
+
+
+def load_corpus(pieces, to_trans=True, linked_only=True, processes=1, root=cache_dir):
+    """
+        load_piece for every piece, optionally fanned out over a process pool (None = one process per core).
+        Results come back in the order of pieces, with None for the pieces that failed.
+        The pool forks, so only ask for one before tensorflow (or anything else running threads) is imported.
+    """
+    pieces = list(pieces)
+    load = partial(
+        load_piece_safely, to_trans=to_trans, linked_only=linked_only, root=root
+    )
+    processes = min(processes or os.cpu_count(), len(pieces))
+    # the training scripts build their env at import time, which spawned workers would re-run
+    if processes <= 1 or "fork" not in multiprocessing.get_all_start_methods():
+        return [load(piece) for piece in tqdm.tqdm(pieces, desc="Preprocessing")]
+    with multiprocessing.get_context("fork").Pool(processes) as pool:
+        # one piece per task: parse times vary a lot, and imap keeps the input order
+        return list(
+            tqdm.tqdm(pool.imap(load, pieces), total=len(pieces), desc="Preprocessing")
+        )
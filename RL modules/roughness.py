@@ -0,0 +1,119 @@
+import numpy as np
+
+# Table-driven version of the roughness feature of the env modules: the roughness of a set of notes is
+# the sum of the ideal ratio N+M over all note pairs, divided by the number of notes.
+# Reference: https://www.researchgate.net/publication/276905584_Measuring_Musical_Consonance_and_Dissonance
+#
+# Notes are spelled pitches (letter, accidental, octave) numbered by spelled_codes. pair_ratio[a][b] is the
+# ratio of the interval between spelled pitches a and b, named the way music21's
+# Interval(noteStart, noteEnd).semiSimpleName names it (undirected, compound intervals reduced to at most
+# an octave) and mapped to a semitone class exactly like the old interval_to_ratio did.
+
+letter_index = {"C": 0, "D": 1, "E": 2, "F": 3, "G": 4, "A": 5, "B": 6}
+letter_semitones = np.array([0, 2, 4, 5, 7, 9, 11])
+accidental_alter = {"": 0, "#": 1, "##": 2, "-": -1, "--": -2}
+min_octave = -1
+max_octave = 9
+num_codes = (max_octave - min_octave + 1) * 7 * 5
+
+# ideal ratio N+M of each interval class (semitones mod 12)
+interval_ratio = np.array(
+    [
+        1 + 1,
+        18 + 17,
+        9 + 8,
+        6 + 5,
+        5 + 4,
+        4 + 3,
+        17 + 12,
+        3 + 2,
+        8 + 5,
+        5 + 3,
+        16 + 9,
+        17 + 9,
+    ]
+)
+# semitones of the perfect (1, 4, 5, 8) or major (2, 3, 6, 7) interval of every semi-simple generic number
+generic_semitones = np.array([0, 0, 2, 4, 5, 7, 9, 11, 12])
+
+
+def build_pair_ratio():
+    codes = np.arange(num_codes)
+    alter = codes % 5 - 2
+    letter = codes // 5 % 7
+    octave = codes // 35 + min_octave
+    staff = 7 * octave + letter
+    semitones = 12 * octave + letter_semitones[letter] + alter
+
+    generic = staff[None, :] - staff[:, None]
+    chromatic = semitones[None, :] - semitones[:, None]
+    # undirected: descending intervals are named like the same interval upwards (unisons keep their sign)
+    flip = generic < 0
+    generic = np.where(flip, -generic, generic)
+    chromatic = np.where(flip, -chromatic, chromatic)
+    # semi-simple: ninths and up lose whole octaves, an octave (or 15th, ...) stays an octave
+    octaves = np.where(generic > 0, (generic - 1) // 7, 0)
+    number = generic - 7 * octaves + 1
+    chromatic = chromatic - 12 * octaves
+    # semitones off the perfect/major interval give the specifier, music21 names -5..4 of them
+    base = generic_semitones[number]
+    shift = chromatic - base
+    named = (shift >= -5) & (shift <= 4)
+    # P/M and d, dd, m, A, AA shift the semitone class, rarer specifiers were not handled and keep it;
+    # unisons were read with the m/d/A/AA branch, so d1 counts -2 and dd1 counts 0
+    shift_class = np.where(np.abs(shift) <= 2, shift, 0)
+    unison = number == 1
+    shift_class = np.where(unison & (shift == -1), -2, shift_class)
+    shift_class = np.where(unison & (shift == -2), 0, shift_class)
+    # intervals music21 cannot name raised, and the pair was skipped
+    return np.where(named, interval_ratio[(base + shift_class) % 12], 0).astype(
+        np.int32
+    )
+
+
+pair_ratio = build_pair_ratio()
+
+
+def spelled_codes(notes, octaves):
+    """
+        Spelled pitch number of every (note name, octave), int16. -1 for pitches outside the table
+        (no octave, or accidentals beyond double sharp/flat); those take no part in roughness.
+    """
+    codes = np.full(len(notes), -1, dtype=np.int16)
+    for i, (name, octave) in enumerate(zip(notes, octaves)):
+        alter = accidental_alter.get(name[1:])
+        if alter is None or octave is None or not min_octave <= octave <= max_octave:
+            continue
+        codes[i] = (
+            ((int(octave) - min_octave) * 7 + letter_index[name[0]]) * 5 + alter + 2
+        )
+    return codes
+
+
+class RoughnessWindow:
+    """
+        Distinct notes of codes[first:last] with their running pair sum, extended one note at a time.
+    """
+
+    def __init__(self, codes, first):
+        self.codes = codes
+        self.first = first
+        self.last = first
+        self.present = np.zeros(num_codes, dtype=bool)
+        # row_sum[c] = sum of pair_ratio[c][m] over the notes m in the window
+        self.row_sum = np.zeros(num_codes, dtype=np.int64)
+        self.count = 0
+        self.pair_sum = 0
+
+    def extend(self, last):
+        for code in self.codes[self.last : last]:
+            if code < 0 or self.present[code]:
+                continue
+            self.present[code] = True
+            self.pair_sum += int(self.row_sum[code])
+            self.row_sum += pair_ratio[code]
+            self.count += 1
+        self.last = max(self.last, last)
+
+    def roughness(self):
+        return self.pair_sum / self.count if self.count != 0 else 0
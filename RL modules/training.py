@@ -1,3 +1,13 @@
+import glob
+from piece_cache import load_corpus
+
+training_pieces = []
+for piece in glob.glob("./normal/training/*"):
+    training_pieces.append(piece)
+# preprocess on every core before tensorflow is imported (forking once its threads run can deadlock);
+# SegmentationEnv below then reads each piece from the cache
+load_corpus(training_pieces, processes=None)
+
 from gym import Env
 from gym.spaces import Discrete, Box
 import numpy as np
@@ -23,11 +33,6 @@ def round_offset(offset):
     return ((offset * 2) // 1) / 2
 
 
-import glob
-
-training_pieces = []
-for piece in glob.glob("./normal/training/*"):
-    training_pieces.append(piece)
 # testing_pieces = []
 # for piece in glob.glob('./testing/*'):
 #     testing_pieces.append(piece)
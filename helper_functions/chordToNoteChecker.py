@@ -52,7 +52,7 @@ pNote4 = []
 for key in major_keys:
     key = key + "Major"
     for chord in major_chords:
-        x = ChordToNote(key, chord)
+        x = ChordToNote(key, chord)[1]
         pKey.append(key)
         pChord.append(chord)
         pNote1.append(x[0])
@@ -66,7 +66,7 @@ for key in major_keys:
 for key in minor_keys:
     key = key + "Minor"
     for chord in minor_chords:
-        x = ChordToNote(key, chord)
+        x = ChordToNote(key, chord)[1]
         pKey.append(key)
         pChord.append(chord)
         pNote1.append(x[0])
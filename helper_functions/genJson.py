@@ -3,6 +3,7 @@ import os, sys
 p = os.path.abspath("../modules")
 sys.path.append(p)
 from chordToNote import ChordToNote
+from chordBundle import templateArrays, writeBundle
 
 # import numpy as np
 import pandas as pd
@@ -59,17 +60,36 @@ minor_chords = [
 # with open('../modules/json_files/keychordmapping.json','w') as f:
 #     json.dump(json_list,f)
 json_list = {}
+bundle_entries = []  # (name, idx, seventh pitch class) for the binary bundle
 for key in major_keys:
     key = key + "Major"
     for chord in major_chords:
         x, y = ChordToNote(key, chord)
-        json_list[key + chord] = {"idx": x, "naming": y, "chord": chord, "key": key}
+        seventh_idx, seventh_names = ChordToNote(key, chord + "7")
+        json_list[key + chord] = {
+            "idx": x,
+            "naming": y,
+            "chord": chord,
+            "key": key,
+            "seventh": seventh_names[-1],
+        }
+        bundle_entries.append((key + chord, x, seventh_idx[-1]))
 for key in minor_keys:
     key = key + "Minor"
     for chord in minor_chords:
         x, y = ChordToNote(key, chord)
-        json_list[key + chord] = {"idx": x, "naming": y, "chord": chord, "key": key}
+        seventh_idx, seventh_names = ChordToNote(key, chord + "7")
+        json_list[key + chord] = {
+            "idx": x,
+            "naming": y,
+            "chord": chord,
+            "key": key,
+            "seventh": seventh_names[-1],
+        }
+        bundle_entries.append((key + chord, x, seventh_idx[-1]))
 
 with open("../modules/json_files/keychorddict.json", "w") as f:
     json.dump(json_list, f)
 
+writeBundle(templateArrays(bundle_entries))
+
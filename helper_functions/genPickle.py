@@ -1,3 +1,11 @@
+import os, sys
+
+p = os.path.abspath("../modules")
+sys.path.append(p)
+from chordBundle import BUNDLE_VERSION, bundle_dir, subsetArrays, writeBundle
+
+import argparse
+import hashlib
 import pandas as pd
 import numpy as np
 import itertools
@@ -20,71 +28,100 @@ def key2num(key):
         return (num + (modifier - 1) * 2) % 12
 
 
-def keys2num(keys):
-    if keys[-1] == "-":
-        return sorted([key2num(key) for key in keys[:-1]])
-    else:
-        return sorted([key2num(key) for key in keys])
+csv_path = "../results/chordToNoteResult.csv"
+pickle_dir = "../modules/pickle_files"
+hash_path = os.path.join(pickle_dir, "key_chord_mapping.sha256")
+# files written by this script; manifest.json is shared with genJson.py, so only its presence is checked
+outputs = [
+    os.path.join(pickle_dir, "key_chord_mapping.pickle"),
+    os.path.join(pickle_dir, "key_chord_name_mapping.pickle"),
+    os.path.join(bundle_dir, "subset_offsets.npy"),
+    os.path.join(bundle_dir, "subset_ids.npy"),
+]
+manifest_path = os.path.join(bundle_dir, "manifest.json")
 
 
-df = pd.read_csv("../results/chordToNoteResult.csv")
-df_copy = df.copy()
-df_copy = df_copy.drop(["Unnamed: 0", "Key", "Chord"], axis=1)
+def file_digest(path):
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
 
-# array: store every chord's key in the same order wrt the csv file
-known_key = list(df_copy.to_numpy())
-for idx in range(len(known_key)):
-    known_key[idx] = sorted(keys2num(known_key[idx]))
 
-# Return whether given arr is a subset of a array in list_arrays
-def subset_in_list(arr, list_arrays):
-    for array in list_arrays:
-        for each in arr:
-            if not (each in array):
-                break
-        else:
-            return True
-    return False
+def output_digests():
+    return ["%s  %s" % (file_digest(path), os.path.basename(path)) for path in outputs]
 
 
-# all combinations of 4 key notes
-combination = np.array(
-    list(
-        itertools.chain.from_iterable(
-            itertools.combinations(np.arange(12), n) for n in range(5)
-        )
+parser = argparse.ArgumentParser(
+    description="Generate the note combination -> chord mappings."
+)
+parser.add_argument(
+    "-n", "--maxnotes", type=int, default=6, help="Largest combination size (0-12)"
+)
+parser.add_argument(
+    "-f", "--force", action="store_true", help="Rebuild even if the csv is unchanged"
+)
+args = parser.parse_args()
+
+# rebuild only when the csv (or anything else that shapes the output) changed, or an output is
+# missing or no longer the file the last run wrote (the hash file records their digests too)
+with open(csv_path, "rb") as f:
+    digest = hashlib.sha256(f.read())
+digest.update(("maxnotes=%d bundle=%d" % (args.maxnotes, BUNDLE_VERSION)).encode())
+digest = digest.hexdigest()
+if (
+    not args.force
+    and os.path.exists(hash_path)
+    and os.path.exists(manifest_path)
+    and all(os.path.exists(path) for path in outputs)
+):
+    with open(hash_path) as f:
+        if f.read().splitlines() == [digest] + output_digests():
+            print(
+                "chordToNoteResult.csv unchanged, nothing to do (use --force to rebuild)"
+            )
+            sys.exit(0)
+
+df = pd.read_csv(csv_path)
+note_columns = [column for column in df.columns if column.startswith("Note")]
+chord_names = (df["Key"] + df["Chord"]).tolist()
+
+# pitch-class mask of every chord row, in csv (= keychorddict.json) order; "-" marks an unused note
+notes = df[note_columns].to_numpy()
+bits = np.zeros(notes.shape, dtype=np.int64)
+for note in np.unique(notes):
+    if note != "-":
+        bits[notes == note] = 1 << key2num(note)
+template_masks = np.bitwise_or.reduce(bits, axis=1)
+
+# subset relation of all 4096 masks against every chord row in one vectorized pass (CSR, see chordBundle.py)
+subsets = subsetArrays(template_masks)
+writeBundle(subsets)
+subset_offsets, subset_ids = subsets["subset_offsets"], subsets["subset_ids"]
+
+# all combinations of up to maxnotes notes, same order (and str(tuple) keys) as before
+combination = list(
+    itertools.chain.from_iterable(
+        itertools.combinations(range(12), n) for n in range(args.maxnotes + 1)
     )
 )
 
-
-# array: possible chord_idx in the same order wrt combination
-key_chord_idx = []
-for combo in combination:
-    chord = []
-    for chord_idx in range(len(known_key)):
-        for note in combo:
-            if not (note in known_key[chord_idx]):
-                break
-        else:
-            chord.append(chord_idx)
-    key_chord_idx.append(chord)
-
-# key --> chord_idx mapping :
 key_chord_mapping = {}
-for idx in range(len(combination)):
-    key_chord_mapping[str(combination[idx])] = key_chord_idx[idx]
-
-# key --> chord_name mapping :
 key_chord_name_mapping = {}
-for key in key_chord_mapping:
-    key_chord_name_mapping[key] = [
-        "".join(df.loc[idx, ["Key", "Chord"]].tolist())
-        for idx in key_chord_mapping[key]
-    ]
-
+for combo in combination:
+    mask = sum(1 << note for note in combo)
+    chord_idx = subset_ids[subset_offsets[mask] : subset_offsets[mask + 1]].tolist()
+    key_chord_mapping[str(combo)] = chord_idx
+    key_chord_name_mapping[str(combo)] = [chord_names[idx] for idx in chord_idx]
 
-with open("../modules/pickle_files/key_chord_mapping.pickle", "wb") as handle:
+with open(os.path.join(pickle_dir, "key_chord_mapping.pickle"), "wb") as handle:
     pickle.dump(key_chord_mapping, handle, protocol=pickle.HIGHEST_PROTOCOL)
 
-with open("../modules/pickle_files/key_chord_name_mapping.pickle", "wb") as handle:
+with open(os.path.join(pickle_dir, "key_chord_name_mapping.pickle"), "wb") as handle:
     pickle.dump(key_chord_name_mapping, handle, protocol=pickle.HIGHEST_PROTOCOL)
+
+with open(hash_path, "w") as f:
+    f.write("\n".join([digest] + output_digests()) + "\n")
+
+print(
+    "%d combinations of up to %d notes, %d subset relations"
+    % (len(combination), args.maxnotes, len(subset_ids))
+)
@@ -0,0 +1,46 @@
+import os, sys
+
+p = os.path.abspath("../modules")
+sys.path.append(p)
+from HMM import HMM
+
+import tempfile
+import numpy as np
+
+# HMM.save followed by HMM.load must give back the same model, whatever the file is called
+states = ["MajorI", "MajorIV", "MajorV"]
+test_cases = [
+    ["model", ["outside chord", "inside chord"]],
+    ["model.npz", ["outside chord", "inside chord"]],
+    ["model.hmm", [0, 1]],
+]
+
+with tempfile.TemporaryDirectory() as root:
+    for name, values in test_cases:
+        path = os.path.join(root, name)
+        model = HMM(len(states), len(values), states, values)
+        model.note_probit = np.random.rand(12)
+        model.save(path)
+        assert os.listdir(root) == [name], os.listdir(root)
+        loaded = HMM.load(path)
+        assert loaded.states == states and loaded.values == values, (
+            name,
+            loaded.values,
+        )
+        assert type(loaded.values[0]) is type(values[0]), name
+        for field in [
+            "initial_matrix",
+            "transition_matrix",
+            "emssion_matrix",
+            "note_probit",
+        ]:
+            assert np.array_equal(getattr(loaded, field), getattr(model, field)), (
+                name,
+                field,
+            )
+        for a, b in zip(loaded.log_matrices(), model.log_matrices()):
+            assert np.array_equal(a, b), name
+        os.remove(path)
+        print(f"{name}: round trip ok")
+
+print("Done!")
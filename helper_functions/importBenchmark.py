@@ -0,0 +1,45 @@
+import os
+import subprocess
+import sys
+import tempfile
+
+# Time a cold import and the first query of each module in a fresh interpreter,
+# launched from an unrelated working directory to make sure no path is cwd-relative.
+modules_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "modules"))
+
+cases = [
+    ("noteToChord", "NoteToChord(['G','Bb','D','F'])"),
+    ("noteToChordFast", "NoteToChordFast(['G','Bb','D','F'])"),
+    ("noteToChordWeighted", "NoteToChord({'G': 1, 'Bb': 1, 'D': 1, 'F': 1}, 'CMajor')"),
+]
+
+snippet = """
+import sys, time
+sys.path.insert(0, {modules_dir!r})
+start = time.time()
+from {module} import *
+mid = time.time()
+{call}
+end = time.time()
+print(mid - start, end - mid)
+"""
+
+runs = 5
+with tempfile.TemporaryDirectory() as cwd:
+    for module, call in cases:
+        code = snippet.format(modules_dir=modules_dir, module=module, call=call)
+        imports, firsts = [], []
+        for _ in range(runs):
+            out = subprocess.run(
+                [sys.executable, "-c", code],
+                cwd=cwd,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.DEVNULL,
+                check=True,
+                universal_newlines=True,
+            ).stdout.split()
+            imports.append(float(out[-2]))
+            firsts.append(float(out[-1]))
+        print(
+            "%s: import %.4f s, first call %.4f s" % (module, min(imports), min(firsts))
+        )
@@ -3,6 +3,8 @@ p = os.path.abspath('../modules')
 sys.path.append(p)
 from noteToChord import NoteToChord
 from noteToChordFast import NoteToChordFast
+import noteToChordWeighted
+import numpy as np
 import time
 
 start = time.time()
@@ -17,6 +19,25 @@ for i in range(1000):
 end = time.time()
 print("Time taken (fast):", (end-start)/1000)
 
+start = time.time()
+for i in range(1000):
+    NoteToChordFast(['G','Bb','D','F'], quiet=True)
+end = time.time()
+print("Time taken (fast, quiet):", (end-start)/1000)
+
+weights = np.random.rand(1000, 12) * (np.random.rand(1000, 12) < 0.4)
+keys = ['CMajor', 'aMinor', 'EbMajor', 'f#Minor'] * 250
+start = time.time()
+for i in range(1000):
+    noteToChordWeighted.NoteToChord(noteToChordWeighted.chromaToKeysDict(weights[i], keys[i]), keys[i])
+end = time.time()
+print("Time taken (weighted):", (end-start)/1000)
+
+start = time.time()
+noteToChordWeighted.NoteToChordBatch(weights, keys)
+end = time.time()
+print("Time taken (weighted batch):", (end-start)/1000)
+
 
 '''
 Test case 1: C E G
@@ -6,7 +6,14 @@ import tqdm
 from tqdm import trange
 import time
 import pickle
+import multiprocessing
+import collections
+import json
+import os
+import zipfile
+from functools import partial
 import noteToChordWeighted  as noteToChord
+from chordTemplateStore import store
 key_mapping={
     'C':0,
     'D':2,
@@ -34,14 +41,12 @@ def keys2num(keys):
     return [key2num(key) for key in keys]
 
 # function to distingish whether notes in given timestamp and chord are within or outside the chord (0=outside,1=within)
-import json
-with open('../modules/json_files/keychorddict.json') as json_file:
-    chord_notes = json.load(json_file)
-  
-    def note_2_class(chord,notes_at_t,chord_notes=chord_notes):
-        notes_at_t=keys2num(notes_at_t)
-        note_in_chord=chord_notes[chord]['idx']
-        return [int(note in note_in_chord) for note in notes_at_t]
+def note_2_class(chord,notes_at_t,chord_notes=None):
+    if chord_notes is None:
+        chord_notes=store.data
+    notes_at_t=keys2num(notes_at_t)
+    note_in_chord=chord_notes[chord]['idx']
+    return [int(note in note_in_chord) for note in notes_at_t]
 
 changekey = {
     "GBMINOR": "F#MINOR",
@@ -77,6 +82,41 @@ def keys2num(keys):
     return [key2num(key) for key in keys]
 
 
+#bump when the arrays written by HMM.save change
+HMM_FORMAT_VERSION=1
+
+#arrays of an .npz, its stored (uncompressed) members memory-mapped in place rather than read;
+#scalars, empty arrays and compressed members are read as usual
+def map_npz(path,mmap_mode='c'):
+    arrays={}
+    with zipfile.ZipFile(path) as archive, open(path,'rb') as f:
+        for info in archive.infolist():
+            name=info.filename[:-4] if info.filename.endswith('.npy') else info.filename
+            if info.compress_type!=zipfile.ZIP_STORED:
+                with archive.open(info) as member:
+                    arrays[name]=np.lib.format.read_array(member)
+                continue
+            #the member's .npy starts after the local header, which repeats the name and extra field lengths
+            f.seek(info.header_offset)
+            header=f.read(30)
+            start=info.header_offset+30+int.from_bytes(header[26:28],'little')+int.from_bytes(header[28:30],'little')
+            f.seek(start)
+            if np.lib.format.read_magic(f)==(1,0):
+                shape,fortran_order,dtype=np.lib.format.read_array_header_1_0(f)
+            else:
+                shape,fortran_order,dtype=np.lib.format.read_array_header_2_0(f)
+            if dtype.hasobject or shape==() or 0 in shape:
+                f.seek(start)
+                arrays[name]=np.lib.format.read_array(f)
+            else:
+                arrays[name]=np.memmap(f,dtype=dtype,mode=mmap_mode,offset=f.tell(),shape=shape,order='F' if fortran_order else 'C')
+    return arrays
+
+#Krumhansl key profiles, normalized
+majorP=np.array([6.35,2.23,3.48,2.33,4.38,4.09,2.52,5.19,2.39,3.66,2.29,2.88])
+minorP=np.array([6.33,2.68,3.52,5.38,2.60,3.53,2.54,4.75,3.98,2.69,3.34,3.17])
+majorP/=majorP.sum()
+minorP/=minorP.sum()
 
 class HMM:
     def __init__(self,no_of_state,no_of_value,states,values):
@@ -105,36 +145,82 @@ class HMM:
         self.observered=None
         self.key=None
         
-        self.probit_at_i_table=None
-        self.probit_transit_i_j_table=None
-        self.forward_table=None
-        self.backward_table=None
         self.chord_probit=None
+        self.log_cache=None  #(initial_matrix, transition_matrix, their logs), see log_matrices
         self.note_probit=None
+        self.state_index={state:idx for idx,state in enumerate(states)}
+        self.label_cache={}  #label -> state indices, see label_states
+        self.counts=None  #supervised counts so far, see partial_fit
+        self.stats=None  #PhaseStats while profiling, see enable_profiling
         
+    #record wall time and call counts of the emission/recursion/backtrace/estep/mstep phases into a PhaseStats
+    #(a new one unless given) until disable_profiling; returns it
+    def enable_profiling(self,stats=None):
+        self.stats=stats if stats is not None else PhaseStats()
+        return self.stats
+
+    def disable_profiling(self):
+        stats,self.stats=self.stats,None
+        return stats
+
+    #log initial and transition matrices for the decoders, reused until either matrix is replaced
+    #(code that edits them in place should reset self.log_cache)
+    def log_matrices(self):
+        cache=self.log_cache
+        if cache is None or cache[0] is not self.initial_matrix or cache[1] is not self.transition_matrix:
+            cache=(self.initial_matrix,self.transition_matrix,np.log(self.initial_matrix),np.log(self.transition_matrix))
+            self.log_cache=cache
+        return cache[2],cache[3]
+
+    #single uncompressed .npz with the trained parameters, the state/value names and the pre-logged matrices,
+    #so load can map it (see map_npz). Written through a file object, so the file is named exactly path
+    #(np.savez would append .npz to a bare name, which load would then not find)
+    def save(self,path):
+        log_initial,log_transition=self.log_matrices()
+        with open(path,'wb') as f:
+            np.savez(f,
+                     format_version=np.array(HMM_FORMAT_VERSION),
+                     states=np.array(self.states),
+                     values=np.array(self.values),
+                     zero=np.array(self.zero),
+                     initial_matrix=self.initial_matrix,
+                     transition_matrix=self.transition_matrix,
+                     emssion_matrix=self.emssion_matrix,
+                     note_probit=np.array([]) if self.note_probit is None else self.note_probit,
+                     log_initial=log_initial,
+                     log_transition=log_transition)
+
+    @classmethod
+    def load(cls,path):
+        #copy-on-write maps: train and partial_fit may still edit the matrices in place
+        f=map_npz(path,'c')
+        version=int(f['format_version'])
+        if version!=HMM_FORMAT_VERSION:
+            raise ValueError('%s: unsupported HMM format version %d (expected %d)'%(path,version,HMM_FORMAT_VERSION))
+        #tolist keeps the saved dtype, e.g. integer values stay ints
+        states=f['states'].tolist()
+        values=f['values'].tolist()
+        model=cls(len(states),len(values),states,values)
+        model.zero=float(f['zero'])
+        model.initial_matrix=f['initial_matrix']
+        model.transition_matrix=f['transition_matrix']
+        model.emssion_matrix=f['emssion_matrix']
+        model.note_probit=f['note_probit'] if f['note_probit'].size else None
+        #decoders use the stored logs directly
+        model.log_cache=(model.initial_matrix,model.transition_matrix,f['log_initial'],f['log_transition'])
+        return model
+
     def debug(self):
         print('initial_matrix\n',self.initial_matrix)
         print('transition_matrix\n',self.transition_matrix)
         print('emission_matrix\n',self.emssion_matrix)
         print("note prob\n",self.note_probit)
     
-    def likelihood(self,state,ob_t,key):
-        
-        #profile
-        majorP=np.array([6.35,2.23,3.48,2.33,4.38,4.09,2.52,5.19,2.39,3.66,2.29,2.88])
-        minorP=np.array([6.33,2.68,3.52,5.38,2.60,3.53,2.54,4.75,3.98,2.69,3.34,3.17])
-        majorP/=majorP.sum()
-        minorP/=minorP.sum()
-        #key mask
-        if key[-5:].lower()!=self.states[state][:5].lower():
-            return np.log(self.zero)
-        
-        chord=key+self.states[state][5:]
-
+    #normalized note2chord scores of every chord in key, as (chord names, probit list)
+    def chord_scores(self,ob_t,key):
         #prediction from note2chord
         a=noteToChord.NoteToChord(ob_t,key,20,0)
-        #print(len(a),a)
-  
+
         #verify output number
         if key[-5:]=='Major':
             if(not(len(a)==12)):
@@ -144,174 +230,257 @@ class HMM:
             if(not(len(a)==15)):
                 print(a,ob_t,key)
             assert(len(a)==15)
-       
-#         seventh=['MinorII',
-#                 'MinorV+',
-#                 'MinorDimVII',
-#                 'MajorII',
-#                 'MajorV',
-#                 'MajorVII']#,'MajorDimVII'
-        chords=[]
-        score=[]
-        
-        for idx,e in enumerate(a):
-            
-#             if sum([s in e['Chord'] for s in seventh]):
-#                 if e['hasSeventh']:
-#                     chords.append(e['Chord']+'7')
-#                     score.append(e['Score'])
-#                 else:
-#                     chords.append(e['Chord']+'7')
-#                     score.append(0)
-            chords.append(e['Chord'])
-            score.append(e['Score'])
-        score=np.array(score)
-        
+
+        chords=[e['Chord'] for e in a]
+        score=np.array([e['Score'] for e in a],dtype=float)
+
         #normalize
         score/=sum(score)
         score=[max(score)-score[e] for e in range(len(score))]
         score=[(np.exp(-100*i)) for i in score] #fixed template probit
         score/=sum(score)
         score=[e if e>0 else self.zero for e in score]
+        return chords,score
 
+    #P(notes|key) from the Krumhansl key profiles, weighted by the note weights of ob_t
+    def note_given_key(self,ob_t,key):
+        observation=ob_t.keys()
+        obs_weight=[ob_t[e] for e in observation]
+        obs_no=keys2num(observation)
+        key_no=keys2num([key[:-5]])[0]
+        profile=majorP if key[-5:]=='Major' else minorP
+        prob_note_given_key=0
+        for i,x in enumerate(obs_no):
+            prob_note_given_key+=profile[x-key_no]*obs_weight[i]
+        return prob_note_given_key
 
-        
-
-        #get the idx of interested chord(state)
-        #chords=[i['Chord']+'7' if i['hasSeventh'] else i['Chord'] for i in a]
-        #print(chords)
+    #chord name of state in key, as spelt by note2chord
+    def state_chord(self,state,key):
+        chord=key+self.states[state][5:]
         if chord[:7]=='dbMinor':
             chord=chord.replace('dbMinor','c#Minor')
         elif chord[:7]=='abMinor':
             chord=chord.replace('abMinor','g#Minor')
         elif chord[:7]=='F#Major':
             chord=chord.replace('F#Major','GbMajor')
-        idx=chords.index(chord)
-        
-        #probit to emit chordNote/non-chordNote
-        observation=ob_t.keys()
-        obs_weight=[ob_t[e] for e in observation]
-      #  obs_2=note_2_class(chord,observation) #2 class
-      #  prob=0
-        note_prob=0
-        obs_no=keys2num(observation)
-        for i,x in enumerate(obs_no):
-            note_prob+=self.note_probit[x]*obs_weight[i]
-     #   for i,x in enumerate(obs_2):
-      #      prob+=(self.emssion_matrix[state][x])*obs_weight[i]
-        
-        prob_note_given_key=0
-
-        key_no=keys2num([key[:-5]])[0]
-        
-        if key[-5:]=='Major':
-            for i,x in enumerate(obs_no):
-                prob_note_given_key+=majorP[x-key_no]*obs_weight[i]
-        else:
-            for i,x in enumerate(obs_no):
-                prob_note_given_key+=minorP[x-key_no]*obs_weight[i]
+        return chord
 
+    def likelihood(self,state,ob_t,key):
+        #key mask
+        if key[-5:].lower()!=self.states[state][:5].lower():
+            return np.log(self.zero)
+        chords,score=self.chord_scores(ob_t,key)
+        idx=chords.index(self.state_chord(state,key))
         assert(score[idx]>0)
-        #assert(prob>0)
             #   N2C P(chord|note)*  P(note)        / P(chord)
-        #return np.log(score[idx])+np.log(note_prob)-np.log(self.chord_probit[state]) # +np.log(prob)
-        '''
-        print(ob_t.keys())
-        print(obs_weight)
-        print(self.states[state])
-        print(key_no)
-        print(chords)
-        print(prob_note_given_key)
-        print(score)
-        print(idx)
-        '''
-        
-        return np.log(prob_note_given_key)+np.log(score[idx])-np.log(self.chord_probit[state])
-        
-    def forward(self,t,j,ob=None,mode=False):
-        if ob is None:
-            ob=self.observered
-        if np.isnan(self.forward_table[t][j]).any():
-            if t==0:
-                if mode==True:
-                    self.forward_table[t][j]=[(np.log(self.initial_matrix[j]))+self.likelihood(j,ob[t],self.key[t]),0]
-                    return self.forward_table[t][j][0],self.forward_table[t][j][1]
-            else:          
-                if mode==True:                
-                    if self.key[t]==self.key[t-1]:
-                        result=np.array([self.forward(t-1,i,ob,mode)[0]+np.log(self.transition_matrix[i][j]) for i in range(self.no_of_state)])+self.likelihood(j,ob[t],self.key[t])
-                    else:
-                        result=np.array([self.forward(t-1,i,ob,mode)[0] for i in range(self.no_of_state)])+self.likelihood(j,ob[t],self.key[t])
-                    self.forward_table[t][j]=[np.max(result),np.argmax(result)]
-                    return self.forward_table[t][j][0],self.forward_table[t][j][1]
-        else:
-            return self.forward_table[t][j]
-    
-    def backward(self,t,i,ob=None):
-        if ob is None:
-            ob=self.observered
-        if np.isnan(self.backward_table[t][i]):
-            if t==len(ob)-1:
-                self.backward_table[t][i]=1
-                return self.backward_table[t][i]
-            else:
-                self.backward_table[t][i]=sum([self.transition_matrix[i][j]*self.likelihood(j,ob[t+1])*self.backward(t+1,j,ob) for j in range(self.no_of_state)])
-                return self.backward_table[t][i]
-        else:
-            return self.backward_table[t][i]
-            
-           
-    def probit_at_i(self,t,i,ob=None):#Gamma γt(i) = P(qt = i|O,λ)      
-        if ob is None:
-            ob=self.observered
-        if np.isnan(self.probit_at_i_table[t][i]):
-            numerator=self.forward(t,i,ob)*self.backward(t,i,ob)#sum probability of all path passing through state[i] at time t
-            denominator=sum([self.forward(t,j,ob)*self.backward(t,j,ob) for j in range(self.no_of_state)]) #prob of passing through  ALL_state at time t
-            self.probit_at_i_table[t][i]=numerator/denominator
-            return self.probit_at_i_table[t][i]
-        else:
-            return self.probit_at_i_table[t][i]
-    
-    def probit_transit_i_j(self,t,i,j,ob=None):#epsilon ξt(i, j) = P(qt = i,qt+1 = j|O,λ)
-        if ob is None:
-            ob=self.observered
-        if np.isnan(self.probit_transit_i_j_table[t][i][j]):
-            numerator=self.forward(t,i,ob)*self.transition_matrix[i][j]*self.likelihood(j,ob[t+1])*self.backward(t+1,j,ob)#sum probability of all path transit from state[i] to state[j] at time t
-            denominator=sum([sum([self.forward(t,m,ob)*self.transition_matrix[m][n]*self.likelihood(n,ob[t+1])*self.backward(t+1,n,ob) for n in range(self.no_of_state)]) for m in range(self.no_of_state)]) #prob of ALL transition combination at time t
-            self.probit_transit_i_j_table[t][i][j]=(numerator/denominator)
-            return self.probit_transit_i_j_table[t][i][j]
-        else:
-            return self.probit_transit_i_j_table[t][i][j]
-    
-    #modify from https://stackoverflow.com/questions/9729968/python-implementation-of-viterbi-algorithm/9730083 , author RBF06(https://stackoverflow.com/users/3311728/rbf06)
-    def predict(self,ob,test_key):  
-        self.forward_table=np.empty((len(ob),self.no_of_state,2))
-        self.forward_table[:]= np.NaN
-        self.key=test_key
+        return np.log(self.note_given_key(ob_t,key))+np.log(score[idx])-np.log(self.chord_probit[state])
+
+    #P(chord) used by likelihood, from the column sums of the transition matrix
+    def set_chord_probit(self):
         self.chord_probit=self.transition_matrix.sum(axis=0)
         self.chord_probit[:18]/=self.chord_probit[:18].sum()
         self.chord_probit[18:]/=self.chord_probit[18:].sum()
-  
- 
 
-        T1=np.empty((self.no_of_state,len(ob)),'d')
-        T2=np.empty((self.no_of_state,len(ob)),'B')
-        for idx in range(self.no_of_state):
-            T1[idx,0]=self.forward(0,idx,ob,True)[0]
-        T2[:,0]=0
-        
-        for i in range(1,len(ob)):
-            for idx in range(self.no_of_state):
-                T1[idx,i],T2[idx,i]=self.forward(i,idx,ob,True)
-        print('!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!')
-        x = np.empty(len(ob), 'B')
-        x[-1] = np.argmax(T1[:, len(ob) - 1])
-        
+    #T x N log-emission table of a piece, cell [t][j] = likelihood(j,obs[t],keys[t])
+    #note2chord and the key profile run once per timestep instead of once per (state, timestep)
+    def emission_matrix(self,obs,keys):
+        stats=self.stats
+        if stats is not None:
+            start=time.perf_counter()
+        self.set_chord_probit()
+        log_zero=np.log(self.zero)
+        table=np.full((len(obs),self.no_of_state),log_zero)
+        for t,(ob_t,key) in enumerate(zip(obs,keys)):
+            chords,score=self.chord_scores(ob_t,key)
+            log_note=np.log(self.note_given_key(ob_t,key))
+            for state in range(self.no_of_state):
+                if key[-5:].lower()!=self.states[state][:5].lower():
+                    continue
+                idx=chords.index(self.state_chord(state,key))
+                assert(score[idx]>0)
+                table[t][state]=log_note+np.log(score[idx])-np.log(self.chord_probit[state])
+        if stats is not None:
+            stats.add('emission',start)
+        return table
+
+    #scaled forward-backward (Rabiner) over a T x N log-emission table, every alpha row is rescaled to sum to 1
+    #like viterbi, the transition term is masked out where the key changes between t-1 and t
+    #returns gamma (T x N), the N x N expected transition counts summed over t and the log-likelihood of the piece
+    def forward_backward(self,log_emission,keys):
+        stats=self.stats
+        if stats is not None:
+            start=time.perf_counter()
+        T,N=log_emission.shape
+        key_kept=np.array([t>0 and keys[t]==keys[t-1] for t in range(T)])
+        emission_max=log_emission.max(axis=1)
+        b=np.exp(log_emission-emission_max[:,None])
+        A=self.transition_matrix
+
+        alpha=np.empty((T,N))
+        scale=np.empty(T)
+        alpha_t=self.initial_matrix*b[0]
+        scale[0]=alpha_t.sum()
+        alpha[0]=alpha_t/scale[0]
+        for t in range(1,T):
+            alpha_t=(alpha[t-1]@A if key_kept[t] else np.ones(N))*b[t]
+            scale[t]=alpha_t.sum()
+            alpha[t]=alpha_t/scale[t]
+
+        #w[t][j] = b_t(j)*beta_t(j)/c_t, shared by the beta recursion and the xi statistics
+        beta=np.empty((T,N))
+        w=np.empty((T,N))
+        beta[-1]=1
+        w[-1]=b[-1]/scale[-1]
+        for t in reversed(range(T-1)):
+            beta[t]=A@w[t+1] if key_kept[t+1] else np.full(N,w[t+1].sum())
+            w[t]=b[t]*beta[t]/scale[t]
+
+        gamma=alpha*beta
+        gamma/=gamma.sum(axis=1,keepdims=True)
+        #xi_t(i,j) = alpha_t(i)*a_ij*w_t+1(j), summed over the steps that keep the key: one N x N product
+        kept=key_kept[1:]
+        expected_transition=A*(alpha[:-1][kept].T@w[1:][kept])
+        log_likelihood=np.log(scale).sum()+emission_max.sum()
+        if stats is not None:
+            stats.add('recursion',start)
+        return gamma,expected_transition,log_likelihood
+
+    #log-space Viterbi, one (N,1)+(N,N) broadcast and argmax per step
+    #the transition term is masked out (treated as log 1) where the key changes between t-1 and t
+    def viterbi(self,log_emission,test_key):
+        stats=self.stats
+        if stats is not None:
+            start=time.perf_counter()
+        T,N=log_emission.shape
+        log_initial,log_transition=self.log_matrices()
+        no_transition=np.zeros((N,N))
+        key_kept=[t>0 and test_key[t]==test_key[t-1] for t in range(T)]
+
+        back_pointer=np.zeros((T,N),dtype=np.intp)
+        delta=log_initial+log_emission[0]
+        cols=np.arange(N)
+        for t in range(1,T):
+            step=log_transition if key_kept[t] else no_transition
+            result=(delta[:,None]+step)+log_emission[t]  #result[i][j]: best path ending at i, then i->j, emitting ob[t]
+            back_pointer[t]=np.argmax(result,axis=0)
+            delta=result[back_pointer[t],cols]
+
         #backtracking
-        for i in reversed(range(1, len(ob))):
-            x[i - 1] = T2[x[i], i]
-        return x
-    
+        if stats is not None:
+            start=stats.add('recursion',start)
+        path=np.empty(T,dtype=np.intp)
+        path[-1]=np.argmax(delta)
+        for t in reversed(range(1,T)):
+            path[t-1]=back_pointer[t,path[t]]
+        if stats is not None:
+            stats.add('backtrace',start)
+        return path
+
+    #Viterbi restricted to the states whose Major/Minor prefix matches the key of each step
+    #masked states are impossible here rather than emitting log(zero), so every step only scores the
+    #|C_t-1| x |C_t| block of compatible transitions (12-15 states of 27)
+    def viterbi_sparse(self,log_emission,test_key):
+        stats=self.stats
+        if stats is not None:
+            start=time.perf_counter()
+        T,N=log_emission.shape
+        log_initial,log_transition=self.log_matrices()
+        mode=[key[-5:].lower() for key in test_key]
+        groups={m:np.array([j for j in range(N) if self.states[j][:5].lower()==m]) for m in set(mode)}
+        blocks={(a,b):log_transition[np.ix_(groups[a],groups[b])] for a in groups for b in groups}
+        zeros={(a,b):np.zeros((len(groups[a]),len(groups[b]))) for a in groups for b in groups}
+
+        back_pointer=np.zeros((T,N),dtype=np.intp)  #global state ids, only compatible columns are used
+        cols=groups[mode[0]]
+        delta=log_initial[cols]+log_emission[0,cols]
+        for t in range(1,T):
+            prev,cols=cols,groups[mode[t]]
+            pair=(mode[t-1],mode[t])
+            step=blocks[pair] if test_key[t]==test_key[t-1] else zeros[pair]
+            result=(delta[:,None]+step)+log_emission[t,cols]
+            best=np.argmax(result,axis=0)
+            back_pointer[t,cols]=prev[best]
+            delta=result[best,np.arange(len(cols))]
+
+        #backtracking
+        if stats is not None:
+            start=stats.add('recursion',start)
+        path=np.empty(T,dtype=np.intp)
+        path[-1]=cols[np.argmax(delta)]
+        for t in reversed(range(1,T)):
+            path[t-1]=back_pointer[t,path[t]]
+        if stats is not None:
+            stats.add('backtrace',start)
+        return path
+
+    #sparse=True decodes over key-compatible states only (see viterbi_sparse); the dense default can,
+    #rarely, route a path through a key-masked state at log(zero) cost
+    def predict(self,ob,test_key,sparse=False):
+        self.key=test_key
+        if sparse:
+            return self.viterbi_sparse(self.emission_matrix(ob,test_key),test_key)
+        return self.viterbi(self.emission_matrix(ob,test_key),test_key)
+
+    #Viterbi over B pieces at once: emission tables are padded to the longest piece and every step is one
+    #(B,1,N)+(B,N,N) broadcast; pieces are sorted longest first so the ones still running at step t are a
+    #prefix of the batch and finished pieces drop out of the computation
+    def viterbi_batch(self,log_emissions,keys_list):
+        stats=self.stats
+        if stats is not None:
+            start=time.perf_counter()
+        N=self.no_of_state
+        #empty pieces get empty paths and take no part in the batch (an empty batch gives [])
+        paths=[np.zeros(0,dtype=np.intp) for _ in log_emissions]
+        order=sorted((b for b in range(len(log_emissions)) if len(log_emissions[b])),key=lambda b:-len(log_emissions[b]))
+        if not order:
+            return paths
+        B=len(order)
+        lengths=np.array([len(log_emissions[b]) for b in order])
+        T=lengths[0]
+        emission=np.zeros((B,T,N))
+        key_kept=np.zeros((B,T),dtype=bool)
+        for row,b in enumerate(order):
+            e,keys=log_emissions[b],keys_list[b]
+            emission[row,:len(e)]=e
+            key_kept[row,1:len(e)]=[keys[t]==keys[t-1] for t in range(1,len(e))]
+        #laid out as [b][j][i] so the max over previous states i runs along the contiguous axis
+        log_initial,log_transition=self.log_matrices()
+        log_transition=log_transition.T
+
+        back_pointer=np.zeros((B,T,N),dtype=np.intp)
+        delta=log_initial+emission[:,0]
+        buffer=np.empty((B,N,N))  #reused every step
+        for t in range(1,T):
+            nb=np.count_nonzero(lengths>t)  #pieces still running
+            result=buffer[:nb]
+            if key_kept[:nb,t].all():
+                step=log_transition
+            else:
+                step=np.where(key_kept[:nb,t,None,None],log_transition,0.0)
+            np.add(delta[:nb,None,:],step,out=result)
+            np.add(result,emission[:nb,t,:,None],out=result)
+            back_pointer[:nb,t]=np.argmax(result,axis=2)
+            delta[:nb]=np.take_along_axis(result,back_pointer[:nb,t,:,None],axis=2)[:,:,0]
+
+        #backtracking, each piece from its own last step
+        if stats is not None:
+            start=stats.add('recursion',start)
+        path=np.zeros((B,T),dtype=np.intp)
+        path[np.arange(B),lengths-1]=np.argmax(delta,axis=1)
+        for t in reversed(range(1,T)):
+            nb=np.count_nonzero(lengths>t)
+            path[np.arange(nb),t-1]=back_pointer[np.arange(nb),t,path[:nb,t]]
+        for row,b in enumerate(order):
+            paths[b]=path[row,:lengths[row]]
+        if stats is not None:
+            stats.add('backtrace',start)
+        return paths
+
+    #decode many pieces together, returns one state path per piece (empty for an empty piece)
+    def predict_batch(self,list_of_obs,list_of_keys):
+        tables=[self.emission_matrix(ob,keys) for ob,keys in zip(list_of_obs,list_of_keys)]
+        return self.viterbi_batch(tables,list_of_keys)
+
     def get_detail(self,label):
         key='Major' if 'M' in label else 'Minor'
         chord=label.split("_")[1]
@@ -353,114 +522,257 @@ class HMM:
   
         return chord,key_note
     
-    def train_supervisied(self,obs,labels): # by MLE
-        
-        initial_matrix= np.zeros(self.no_of_state)
-        emssion_matrix=np.zeros((2)) 
-        transition_matrix=np.array([np.zeros(self.no_of_state) for i in range(self.no_of_state)])
+    #state indices of a label: (as a first segment, as a transition endpoint), parsed once per distinct label
+    #transitions drop the '+' of Major chords, first segments keep it (None when that is not a state)
+    def label_states(self,label):
+        found=self.label_cache.get(label)
+        if found is None:
+            state_index=self.state_index
+            chord,_=self.get_detail(label)
+            plain=chord.replace('+','') if '+' in chord and 'Major' in chord else chord
+            if plain not in state_index:
+                raise ValueError('%s: %s is not a state'%(label,plain))
+            found=self.label_cache[label]=(state_index.get(chord),state_index[plain])
+        return found
+
+    #sufficient statistics of one labelled piece: initial, transition and note counts
+    def supervised_counts(self,ob,label):
+        initial_matrix=np.zeros(self.no_of_state)
+        transition_matrix=np.zeros((self.no_of_state,self.no_of_state))
         note_list=np.zeros(12)
+        if len(label)==0:
+            return {'initial':initial_matrix,'transition':transition_matrix,'notes':note_list}
+        first,_=self.label_states(label[0])
+        if first is None:
+            raise ValueError('%s: %s is not a state'%(label[0],self.get_detail(label[0])[0]))
+        initial_matrix[first]+=1
+        path=np.array([self.label_states(lab)[1] for lab in label])
+        np.add.at(transition_matrix,(path[:-1],path[1:]),1)
+        #notes of the first segment are not counted, as before
+        notes=[note for ob_t in ob[1:len(label)] for note in keys2num(ob_t)]
+        np.add.at(note_list,np.array(notes,dtype=int),1)
+        return {'initial':initial_matrix,'transition':transition_matrix,'notes':note_list}
+
+    #expected sufficient statistics of one piece under the current model (Baum-Welch E-step)
+    def expected_counts(self,ob,keys):
+        if isinstance(keys,str):
+            keys=[keys]*len(ob)
+        gamma,xi,log_likelihood=self.forward_backward(self.emission_matrix(ob,keys),keys)
+        return {'initial':gamma[0],'transition':xi,'log_likelihood':log_likelihood}
+
+    #per-piece statistics for every (ob, label_or_keys) pair, summed field by field
+    #processes>1 shards the pieces over a process pool (None = one per core), each worker holding a copy of the model
+    def collect_counts(self,worker,obs,others,processes=1):
+        pieces=list(zip(obs,others))
+        if processes is not None and processes<=1:
+            results=(getattr(self,worker)(ob,other) for ob,other in pieces)
+            return merge_counts(results)
+        processes=processes or os.cpu_count()
+        chunksize=max(1,len(pieces)//(4*processes))
+        with multiprocessing.Pool(processes,initializer=_init_worker,initargs=(self,)) as pool:
+            #imap keeps piece order, so the merged sums match a serial run exactly
+            return merge_counts(pool.imap(partial(_run_worker,worker),pieces,chunksize))
+
+    def train_supervisied(self,obs,labels,processes=1): # by MLE
+        self.counts=None
+        self.partial_fit(obs,labels,processes)
+
+    #add labelled pieces to the counts kept from earlier train_supervisied/partial_fit calls and re-estimate
+    def partial_fit(self,obs,labels,processes=1):
+        stats=self.stats
+        if stats is not None:
+            start=time.perf_counter()
+        counts=self.collect_counts('supervised_counts',obs,labels,processes)
+        if counts is None:
+            return
+        self.counts=counts if self.counts is None else merge_counts([self.counts,counts])
+        if stats is not None:
+            start=stats.add('estep',start)
+        self.estimate_supervised()
+        if stats is not None:
+            stats.add('mstep',start)
+
+    def estimate_supervised(self):
+        initial_matrix=self.counts['initial']
+        transition_matrix=self.counts['transition']
+        note_list=self.counts['notes']
 
-        for idx_1,label in enumerate(labels):#loop each score
-            for idx_2,lab in enumerate(label):
-
-                chord,key_name=self.get_detail(label[idx_2])
-                if idx_2==0:
-                    initial_matrix[self.states.index(chord)]+=1
-                else:
-                    Pre_chord,Pre_key_name=self.get_detail(label[idx_2-1])
-                    if '+' in Pre_chord and 'Major' in Pre_chord:
-                        Pre_chord=Pre_chord.replace('+','')
-                    if '+' in chord and 'Major' in chord:
-                        chord=chord.replace('+','')
-                        
-                    
-                    transition_matrix[self.states.index(Pre_chord)][self.states.index(chord)]+=1
-                    ob_t_no=keys2num(obs[idx_1][idx_2])
-                 #   ob_t=note_2_class(key_name+chord,obs[idx_1][idx_2]) #2 class
-               #     for x in ob_t:
-              #          emssion_matrix[x]+=1
-                    for x in ob_t_no:
-                        note_list[x]+=1
-                        
         #save back to model
-        self.initial_matrix=np.array([item/initial_matrix.sum() if item >0 else self.zero for item in initial_matrix])
-        self.transition_matrix=np.array([row/row.sum() if row.sum()>0 else row+self.zero for row in transition_matrix])
+        self.initial_matrix=np.where(initial_matrix>0,initial_matrix/initial_matrix.sum(),self.zero)
+        self.transition_matrix=normalize_rows(transition_matrix,self.zero)
         
         #import transition calculated from ABC dataset
         #with open('C:/Users/tokah/Documents/fyp-chord-identification/data/beet_Transition', 'rb') as handle:
             #b_transition = pickle.load(handle)
         #self.transition_matrix=b_transition*0.1+self.transition_matrix*0.9
         
-        self.transition_matrix=np.array([row/row.sum() if row.sum()>0 else row+self.zero for row in self.transition_matrix])
-        
-        
-        for row in range(self.transition_matrix.shape[0]):
-            for col in range(self.transition_matrix.shape[1]):
-                if self.transition_matrix[row][col]==0:
-                    self.transition_matrix[row][col]=self.zero
+        self.transition_matrix=normalize_rows(self.transition_matrix,self.zero)
+        self.transition_matrix[self.transition_matrix==0]=self.zero
      #   self.emssion_matrix=np.array([emssion_matrix/emssion_matrix.sum()] *self.no_of_state) 
-        self.note_probit=note_list/sum(note_list)
+        self.note_probit=note_list/note_list.sum()
 
       
-    def train(self,obs,key_name,epochs=2):
+    #Baum-Welch re-estimation of the transition matrix (initial and emission parameters are kept, as before)
+    #key_name[idx]: the key of every segment of obs[idx], or a single key for the whole piece
+    #processes>1 runs the E-step of each epoch on a process pool, see collect_counts
+    def train(self,obs,key_name,epochs=2,processes=1):
         #O:observed values
         #λ:model parameters
-
-        
+        obs=list(obs)
+        if not obs:
+            #there would be no counts to re-estimate from
+            raise ValueError('train needs at least one piece')
+        history=[]
+        stats=self.stats
         for epoch in range(epochs):
-            for ob_idx,ob in enumerate(obs):
+            if stats is not None:
+                start=time.perf_counter()
+            counts=self.collect_counts('expected_counts',obs,key_name,processes)
+            if stats is not None:
+                start=stats.add('estep',start)
+            expected_transition=counts['transition']
+            total_log_likelihood=float(counts['log_likelihood'])
 
-                print('running',ob_idx,key_name[ob_idx].lower()[:-1])
-                
-                self.probit_at_i_table=np.empty((len(ob),self.no_of_state))
-                self.probit_transit_i_j_table=np.empty((len(ob),self.no_of_state,self.no_of_state))
-                self.forward_table=np.empty((len(ob),self.no_of_state))
-                self.backward_table=np.empty((len(ob),self.no_of_state))
-                self.probit_at_i_table[:]= np.NaN
-                self.probit_transit_i_j_table[:]=np.NaN
-                self.forward_table[:]= np.NaN
-                self.backward_table[:]=np.NaN
-
-                #initalize DP table
-                for t, i in tqdm.tqdm(itertools.product(range(len(ob)),range(self.no_of_state))):
-                    self.forward(t,i,ob)
-                    self.backward(t,i,ob)
-                    self.probit_at_i(t,i,ob)
-                    for j in range(self.no_of_state):
-                        if t!=len(ob)-1:
-                            self.probit_transit_i_j(t,i,j,ob)
-                
-                
-                
-                #initial matrix
-                #for i in range(self.no_of_state):
-                #    self.initial_matrix[i]=self.probit_at_i(0,i,ob)
-                #    if self.initial_matrix[i]==0:
-                #        self.initial_matrix[i]=0.00000001
-                
-                #transition matrix
-                for i, j in itertools.product(range(self.no_of_state),range(self.no_of_state)):
-                    self.transition_matrix[i][j]=sum([self.probit_transit_i_j(t,i,j,ob) for t in range(len(ob)-1)])/sum([self.probit_at_i(t,i,ob) for t in range(len(ob)-1)])
-                    if self.transition_matrix[i][j]==0 :
-                        self.transition_matrix[i][j]=self.zero
-                #emission matrix
-                #for j, k in itertools.product(range(self.no_of_state),range(len(self.values))):   
-                #    total=0
-                #    
-                #    #Modification: convert notes to 2 classes (outside or inside given chord)
-                #    chord=self.states[j]  #numeric to chord name
-                #    ob_2_class=[note_2_class(chord,ob_t) for ob_t in ob] #2 class
-
-                #    for t in range(len(ob)):
-                #        if k in ob_2_class[t]:
-                #            #Modification: multiple by how many times do k appear at timestamp t
-                #            total+=self.probit_at_i(t,j,ob)*ob_2_class[t].count(k)  
-                            
-                #    #Modification: multiple by len(ob[t]), which is the total length of notes at timestamp t                    
-                #    self.emssion_matrix[:,k]=total/sum([self.probit_at_i(t,j,ob)*len(ob[t]) for t in range(len(ob))])  
-                    
-                #    #smoothing
-                    
-                #    if self.emssion_matrix[j][k]==0 :
-                #        self.emssion_matrix[:,k]=0.00000001
-                     
\ No newline at end of file
+            #transition matrix, a_ij = sum_t xi_t(i,j) / sum_t gamma_t(i) over the key-preserving steps
+            visits=expected_transition.sum(axis=1)
+            seen=visits>0
+            self.transition_matrix[seen]=expected_transition[seen]/visits[seen][:,None]
+            self.transition_matrix[self.transition_matrix==0]=self.zero
+            self.log_cache=None  #updated in place
+            if stats is not None:
+                stats.add('mstep',start)
+            print('epoch',epoch,'log likelihood',total_log_likelihood)
+            history.append(total_log_likelihood)
+        return history
+
+    #online decoder for segments that arrive one at a time, see StreamingViterbi
+    def streaming_decoder(self,lag=8):
+        return StreamingViterbi(self,lag)
+
+
+#fixed-lag Viterbi: push(ob_t,key) scores one segment and returns the (t, state) labels that became final.
+#labels are final up to the newest step all surviving paths agree on (there they equal the offline Viterbi path),
+#and a label that is `lag` steps old is forced from the currently best path (lag=None: never forced).
+#only back-pointers of steps without a final label are kept, so memory is O(N*lag) and a push costs O(N^2+N*lag)
+class StreamingViterbi:
+    def __init__(self,model,lag=8):
+        self.model=model
+        self.lag=lag
+        self.log_initial,self.log_transition=model.log_matrices()
+        self.no_transition=np.zeros_like(self.log_transition)
+        self.cols=np.arange(model.no_of_state)
+        self.reset()
+
+    def reset(self):
+        self.delta=None
+        self.prev_key=None
+        self.t=-1
+        self.first_open=0  #earliest step without a final label
+        self.back_pointer=collections.deque()  #back-pointer rows of steps first_open+1..t
+
+    def push(self,ob_t,key):
+        log_emission=self.model.emission_matrix([ob_t],[key])[0]
+        self.t+=1
+        if self.delta is None:
+            self.delta=self.log_initial+log_emission
+        else:
+            step=self.log_transition if key==self.prev_key else self.no_transition
+            result=(self.delta[:,None]+step)+log_emission
+            row=np.argmax(result,axis=0)
+            self.delta=result[row,self.cols]
+            if self.t>self.first_open:  #otherwise step t-1 is already final
+                self.back_pointer.append(row)
+        self.prev_key=key
+
+        #path convergence: walk the surviving states back until they collapse to one
+        upto=self.first_open-1
+        states=self.cols
+        u=self.t
+        for row in reversed(self.back_pointer):
+            states=np.unique(row[states])
+            u-=1
+            if len(states)==1:
+                upto=u
+                break
+        if self.lag is not None:
+            upto=max(upto,self.t-self.lag)
+        return self.emit(upto)
+
+    #end of stream: every remaining label comes from the best path
+    def flush(self):
+        final=self.emit(self.t)
+        self.reset()
+        return final
+
+    #make steps first_open..upto final, following the best current path back
+    def emit(self,upto):
+        if self.delta is None or upto<self.first_open:
+            return []
+        path=[int(np.argmax(self.delta))]
+        for row in reversed(self.back_pointer):
+            path.append(int(row[path[-1]]))
+        path.reverse()  #path[k] is the state at first_open+k
+        final=[(self.first_open+k,path[k]) for k in range(upto-self.first_open+1)]
+        for _ in range(min(upto+1-self.first_open,len(self.back_pointer))):
+            self.back_pointer.popleft()
+        self.first_open=upto+1
+        return final
+
+
+#wall time and call count per HMM phase, filled while profiling is enabled (HMM.enable_profiling)
+#phases nest: estep includes the emission and recursion time of serial E-steps; with processes>1
+#the workers profile their own model copies, so only estep/mstep are recorded
+class PhaseStats:
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.seconds=collections.defaultdict(float)
+        self.calls=collections.defaultdict(int)
+
+    #close a phase started at `start` (a time.perf_counter() value), returns the current time for the next phase
+    def add(self,phase,start):
+        now=time.perf_counter()
+        self.seconds[phase]+=now-start
+        self.calls[phase]+=1
+        return now
+
+    def report(self):
+        return {phase:{'calls':self.calls[phase],'seconds':self.seconds[phase],'mean ms':self.seconds[phase]*1000/self.calls[phase]} for phase in self.seconds}
+
+    def write_json(self,path):
+        with open(path,'w') as f:
+            json.dump(self.report(),f,indent=1,sort_keys=True)
+
+    def __repr__(self):
+        return '\n'.join('%-10s %6d calls %10.3f s %10.3f ms/call'%(phase,row['calls'],row['seconds'],row['mean ms']) for phase,row in self.report().items())
+
+
+#sum per-piece statistics dicts field by field
+def merge_counts(results):
+    total=None
+    for result in results:
+        if total is None:
+            total={name:np.copy(value) for name,value in result.items()}
+        else:
+            for name,value in result.items():
+                total[name]+=value
+    return total
+
+#rows divided by their sums, rows without counts set to zero
+def normalize_rows(matrix,zero):
+    sums=matrix.sum(axis=1)
+    seen=sums>0
+    result=np.full(matrix.shape,zero)
+    result[seen]=matrix[seen]/sums[seen][:,None]
+    return result
+
+#model copy of a training worker process, set once per pool by _init_worker
+_worker_model=None
+
+def _init_worker(model):
+    global _worker_model
+    _worker_model=model
+
+def _run_worker(worker,piece):
+    return getattr(_worker_model,worker)(*piece)
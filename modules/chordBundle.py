@@ -0,0 +1,141 @@
+import json
+import os
+import numpy as np
+from chordMask import NUM_MASKS
+
+# Binary chord template bundle: one raw .npy file per array plus manifest.json, all in one directory.
+# Raw .npy (unlike .npz members) can be opened with mmap_mode="r", so every worker process maps the
+# same page-cached file instead of unpickling its own copy of the mappings.
+#
+# Template arrays, one row per keychorddict.json entry in file order (written by genJson.py):
+#   masks         uint16 (N,)   12-bit pitch-class mask of the template
+#   roots         int8   (N,)   pitch class of the root
+#   sevenths      int8   (N,)   pitch class of the seventh
+#   idx           int8   (N, 4) template pitch classes, -1 padded
+#   name_offsets  int32  (N+1,) template i is names[name_offsets[i]:name_offsets[i + 1]] (ASCII)
+#   names         uint8
+# Subset relation over all 4096 masks in CSR form (written by genPickle.py):
+#   subset_offsets int32 (4097,) templates containing mask m are subset_ids[subset_offsets[m]:subset_offsets[m + 1]]
+#   subset_ids     int16         template rows, ascending
+
+BUNDLE_VERSION = 1
+bundle_dir = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "npy_files", "chord_bundle"
+)
+
+
+def writeBundle(arrays, root=bundle_dir):
+    """
+        Write (or replace) the given arrays and record them in manifest.json.
+        genJson.py and genPickle.py each write their own part of the bundle.
+    """
+    os.makedirs(root, exist_ok=True)
+    manifest_path = os.path.join(root, "manifest.json")
+    manifest = {"version": BUNDLE_VERSION, "arrays": {}}
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as f:
+            old = json.load(f)
+        if old.get("version") == BUNDLE_VERSION:
+            manifest = old
+    for name, array in arrays.items():
+        array = np.ascontiguousarray(array)
+        np.save(os.path.join(root, name + ".npy"), array)
+        manifest["arrays"][name] = {
+            "dtype": array.dtype.str,
+            "shape": list(array.shape),
+        }
+    with open(manifest_path, "w") as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+
+
+def loadBundle(root=bundle_dir, mmap_mode="r"):
+    """
+        Map every array listed in the manifest. Returns None when the bundle is missing
+        or was written by another BUNDLE_VERSION.
+    """
+    manifest_path = os.path.join(root, "manifest.json")
+    if not os.path.exists(manifest_path):
+        return None
+    with open(manifest_path) as f:
+        manifest = json.load(f)
+    if manifest.get("version") != BUNDLE_VERSION:
+        return None
+    return {
+        name: np.load(os.path.join(root, name + ".npy"), mmap_mode=mmap_mode)
+        for name in manifest["arrays"]
+    }
+
+
+def templateArrays(entries):
+    """
+        Template part of the bundle from (name, idx, seventh pitch class) triples in keychorddict order.
+    """
+    n = len(entries)
+    masks = np.zeros(n, dtype=np.uint16)
+    roots = np.zeros(n, dtype=np.int8)
+    sevenths = np.zeros(n, dtype=np.int8)
+    idx = np.full((n, 4), -1, dtype=np.int8)
+    encoded = [name.encode("ascii") for name, _, _ in entries]
+    name_offsets = np.zeros(n + 1, dtype=np.int32)
+    name_offsets[1:] = np.cumsum([len(name) for name in encoded])
+    for row, (name, notes, seventh) in enumerate(entries):
+        for note in notes:
+            masks[row] |= 1 << note
+        roots[row] = notes[0]
+        sevenths[row] = seventh
+        idx[row, : len(notes)] = notes
+    return {
+        "masks": masks,
+        "roots": roots,
+        "sevenths": sevenths,
+        "idx": idx,
+        "name_offsets": name_offsets,
+        "names": np.frombuffer(b"".join(encoded), dtype=np.uint8),
+    }
+
+
+def subsetArrays(template_masks):
+    """
+        CSR subset relation: for every mask m, the rows r with template_masks[r] & m == m.
+    """
+    template_masks = np.asarray(template_masks, dtype=np.int64)
+    all_masks = np.arange(NUM_MASKS, dtype=np.int64)
+    contains = (template_masks[None, :] & all_masks[:, None]) == all_masks[:, None]
+    subset_offsets = np.zeros(NUM_MASKS + 1, dtype=np.int32)
+    subset_offsets[1:] = np.cumsum(contains.sum(axis=1))
+    # nonzero walks the matrix row by row, so ids come out grouped by mask and ascending
+    subset_ids = np.nonzero(contains)[1].astype(np.int16)
+    return {"subset_offsets": subset_offsets, "subset_ids": subset_ids}
+
+
+def bundleNames(bundle):
+    blob = bundle["names"].tobytes()
+    offsets = bundle["name_offsets"]
+    return [
+        blob[offsets[i] : offsets[i + 1]].decode("ascii")
+        for i in range(len(offsets) - 1)
+    ]
+
+
+class BundleMaskTable:
+    """
+        Drop-in for the list built by chordMask.buildMaskTable, reading the mapped CSR arrays.
+        Rows are decoded to chord names on first access and kept.
+    """
+
+    def __init__(self, bundle):
+        self.names = bundleNames(bundle)
+        self.offsets = bundle["subset_offsets"]
+        self.ids = bundle["subset_ids"]
+        self.rows = {}
+
+    def __len__(self):
+        return NUM_MASKS
+
+    def __getitem__(self, mask):
+        row = self.rows.get(mask)
+        if row is None:
+            names = self.names
+            ids = self.ids[self.offsets[mask] : self.offsets[mask + 1]].tolist()
+            row = self.rows[mask] = [names[i] for i in ids]
+        return row
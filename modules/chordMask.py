@@ -0,0 +1,47 @@
+# Pitch-class sets are encoded as 12-bit masks, bit i set <=> pitch class i (0 = C, 11 = B) present.
+NUM_MASKS = 1 << 12
+MAX_CHORD_NOTES = 4  # templates in keychorddict.json have 3 or 4 notes
+
+popcount = [bin(m).count("1") for m in range(NUM_MASKS)]
+
+
+def notesToMask(keys_idx):
+    mask = 0
+    for idx in keys_idx:
+        mask |= 1 << idx
+    return mask
+
+
+def submasks(mask):
+    # (sub - 1) & mask walks every subset of mask, from mask itself down to 0
+    sub = mask
+    while True:
+        yield sub
+        if sub == 0:
+            return
+        sub = (sub - 1) & mask
+
+
+def buildMaskTable(data):
+    """
+        Build the 4096-entry lookup table.
+        table[mask] lists every chord (in keychorddict order) whose template contains all pitch classes in mask,
+        i.e. the same content as key_chord_name_mapping[str(tuple(sorted_keys))].
+    """
+    table = [[] for _ in range(NUM_MASKS)]
+    for name, entry in data.items():
+        for sub in submasks(notesToMask(entry["idx"])):
+            table[sub].append(name)
+    return table
+
+
+def candidateChords(table, mask, threshold=2, maxNotes=MAX_CHORD_NOTES):
+    """
+        Union of table[sub] over every subset sub of mask with threshold <= |sub| <= maxNotes.
+        Equivalent to looping itertools.combinations(sorted_keys, i) for i in range(threshold, maxNotes + 1).
+    """
+    possible_chords = set()
+    for sub in submasks(mask):
+        if threshold <= popcount[sub] <= maxNotes:
+            possible_chords.update(table[sub])
+    return possible_chords
@@ -0,0 +1,77 @@
+import json
+import os
+import pickle
+import sys
+from chordMask import buildMaskTable
+
+module_dir = os.path.dirname(os.path.abspath(__file__))
+
+
+class ChordTemplateStore:
+    """
+        Chord vocabulary shared by the note to chord modules, HMM and the labelling scripts.
+        Paths are resolved relative to this package instead of the working directory,
+        and every artifact is only read on first access.
+    """
+
+    def __init__(self, root=module_dir):
+        self.root = root
+        self._data = None
+        self._bundle = False  # False = not looked up yet, None = no usable bundle
+        self._mask_table = None
+        self._name_mapping = None
+
+    def path(self, *parts):
+        return os.path.join(self.root, *parts)
+
+    @property
+    def data(self):
+        # keychorddict.json, with every "key" field upper-cased for matching
+        if self._data is None:
+            with open(self.path("json_files", "keychorddict.json")) as f:
+                data = json.load(f)
+            for k in data:
+                data[k]["key"] = data[k]["key"].upper()
+            self._data = data
+        return self._data
+
+    @property
+    def bundle(self):
+        # memory-mapped arrays of npy_files/chord_bundle (see chordBundle.py), None if absent or stale
+        if self._bundle is False:
+            from chordBundle import loadBundle  # pulls in numpy, so only on first use
+
+            bundle = loadBundle(self.path("npy_files", "chord_bundle"))
+            if bundle is not None and "subset_ids" not in bundle:
+                bundle = None
+            self._bundle = bundle
+        return self._bundle
+
+    @property
+    def mask_table(self):
+        # 4096-entry pitch-class mask -> chord names table, read from the bundle when it matches
+        # keychorddict.json, otherwise built with chordMask.buildMaskTable.
+        # Pure python callers skip the bundle: importing numpy costs more than building the table.
+        if self._mask_table is None:
+            table = None
+            if "numpy" in sys.modules and self.bundle is not None:
+                from chordBundle import BundleMaskTable
+
+                table = BundleMaskTable(self.bundle)
+                if table.names != list(self.data):
+                    table = None
+            self._mask_table = table if table is not None else buildMaskTable(self.data)
+        return self._mask_table
+
+    @property
+    def key_chord_name_mapping(self):
+        # legacy str(tuple(sorted_keys)) -> chord names mapping from genPickle.py
+        if self._name_mapping is None:
+            with open(
+                self.path("pickle_files", "key_chord_name_mapping.pickle"), "rb"
+            ) as f:
+                self._name_mapping = pickle.load(f)
+        return self._name_mapping
+
+
+store = ChordTemplateStore()
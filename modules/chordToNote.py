@@ -1,4 +1,5 @@
 import argparse
+import numpy as np
 
 # parameters
 major_offset = [0, 4, 7, 10]  # 0 is the root of the chord
@@ -294,7 +295,7 @@ def noteNaming(notes, key, chord, ctype):
     return output_notes
 
 
-def ChordToNote(key, chord):
+def computeChordToNote(key, chord):
     ctype, isSeven = typeAnalysis(key, chord)
     start, isMajor = startPosition(key, chord, ctype, isSeven)
     notes = []
@@ -354,6 +355,74 @@ def ChordToNote(key, chord):
     return notes, x  # change to return notes,x when it using Checker.
 
 
+# Every key and chord symbol the parser accepts, used to compile the lookup table
+table_tonics = [
+    tonic + accidental for tonic in "CDEFGAB" for accidental in ["", "b", "#"]
+]
+table_romans = ["I", "II", "III", "IV", "V", "VI", "VII"]
+table_chords = [
+    roman + suffix + seven
+    for roman in table_romans
+    for suffix in ["", "+", "-"]
+    for seven in ["", "7"]
+] + [
+    prefix + roman + seven
+    for prefix in ["b", "Ger", "Fre", "Ita", "Dim", "Aug"]
+    for roman in table_romans
+    for seven in ["", "7"]
+]
+
+# (key.upper(), chord.upper()) -> (notes, names); parsing is case-insensitive
+chord_table = {}
+table_entries = []  # (key, chord) pairs of the compiled table, in compile order
+
+
+def compileChordTable():
+    if table_entries:
+        return
+    for tonic in table_tonics:
+        for mode, display in [("Major", tonic), ("Minor", tonic.lower())]:
+            key = display + mode
+            try:
+                compiled = [computeChordToNote(key, chord) for chord in table_chords]
+            except KeyError:  # no relative major spelling for this minor key
+                continue
+            for chord, (notes, names) in zip(table_chords, compiled):
+                chord_table[(key.upper(), chord.upper())] = (tuple(notes), tuple(names))
+                table_entries.append((key, chord))
+
+
+def ChordToNote(key, chord):
+    """
+        Table lookup version of computeChordToNote, same (notes, names) output.
+        Inputs outside the compiled table are parsed once and memoized.
+    """
+    compileChordTable()
+    lookup = (key.upper(), chord.upper())
+    if lookup not in chord_table:
+        notes, names = computeChordToNote(key, chord)
+        chord_table[lookup] = (tuple(notes), tuple(names))
+    notes, names = chord_table[lookup]
+    return list(notes), list(names)
+
+
+def ChordToNoteTable():
+    """
+        The whole compiled table as arrays, one row per (key, chord).
+        idx is padded with -1 and naming with "" for triads.
+    """
+    compileChordTable()
+    keys = np.array([key for key, chord in table_entries])
+    chords = np.array([chord for key, chord in table_entries])
+    idx = np.full((len(table_entries), 4), -1, dtype=int)
+    naming = np.full((len(table_entries), 4), "", dtype=object)
+    for row, (key, chord) in enumerate(table_entries):
+        notes, names = chord_table[(key.upper(), chord.upper())]
+        idx[row, : len(notes)] = notes
+        naming[row, : len(names)] = names
+    return {"key": keys, "chord": chords, "idx": idx, "naming": naming}
+
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Output notes in a given chord.")
     parser.add_argument(
@@ -1,17 +1,7 @@
-import json
-import pandas as pd
 import argparse
 import time
-import itertools
-import pickle
-from chordToNote import ChordToNote
-
-with open("../modules/json_files/keychorddict.json") as f:
-    data = json.load(f)
-with open("../modules/pickle_files/key_chord_name_mapping.pickle", "rb") as f:
-    key_chord_name_mapping = pickle.load(f)
-for k in data:
-    data[k]["key"] = data[k]["key"].upper()
+from chordMask import notesToMask, candidateChords
+from chordTemplateStore import store
 
 
 def intersection(a, b):
@@ -68,7 +58,7 @@ def ScoringModule(
     return score
 
 
-def MatchAnalysis(input_idx, input_name, chord_idx, chord_name, chord, key):
+def MatchAnalysis(input_idx, input_name, chord_idx, chord_name, seventhNote):
     idxMatch = intersection(input_idx, chord_idx)
     nameMatch = intersection(input_name, chord_name)
     if chord_name[0] in input_name:
@@ -84,7 +74,7 @@ def MatchAnalysis(input_idx, input_name, chord_idx, chord_name, chord, key):
         length_match = False
     else:
         length_match = True
-    seventhNote = ChordToNote(key, chord + "7")[-1]
+    # seventhNote is precomputed per (key, chord) by genJson.py and stored in keychorddict.json
     hasSeventh = seventhNote in input_name
     return (
         len(idxMatch),
@@ -131,13 +121,7 @@ def NoteToChord(keys_name, key=None, numOut=10, threshold=2):
         key = key.upper()
     keys_name = [kn[:-1] + "b" if kn[-1] == "-" else kn for kn in keys_name]
     keys_idx = keys2num(keys_name)
-    sorted_keys = sorted(list(set(keys_idx)))
-
-    possible_chords = set()
-    for i in range(threshold, 5):
-        for each in itertools.combinations(sorted_keys, i):
-            possible_chords.update(key_chord_name_mapping[str(each)])
-    chords = list(possible_chords)
+    chords = list(candidateChords(store.mask_table, notesToMask(keys_idx), threshold))
     if chords == []:
         return None, None
 
@@ -151,7 +135,7 @@ def NoteToChord(keys_name, key=None, numOut=10, threshold=2):
     hasSeventh = []
     numOk = 0
     for idx, chord in enumerate(chords):
-        entry = data[chord]
+        entry = store.data[chord]
         if (
             key is None or entry["key"] == key
         ):  ## remeber to make all key upper() after import**********\
@@ -168,12 +152,7 @@ def NoteToChord(keys_name, key=None, numOut=10, threshold=2):
                 root_first,
                 isSeventh,
             ) = MatchAnalysis(
-                keys_idx,
-                keys_name,
-                entry["idx"],
-                entry["naming"],
-                entry["chord"],
-                entry["key"],
+                keys_idx, keys_name, entry["idx"], entry["naming"], entry["seventh"]
             )
             score = ScoringModule(
                 idxMatch,
@@ -1,14 +1,9 @@
 import argparse
-import pickle
-import json
-import pandas as pd
+import heapq
 import time
-
-with open('pickle_files/key_chord_name_mapping.pickle','rb') as f:
-  key_chord_name_mapping = pickle.load(f)
-
-with open('json_files/keychorddict.json') as f:
-    data = json.load(f)
+from operator import itemgetter
+from chordMask import notesToMask
+from chordTemplateStore import store
 
 key_mapping={
     'C':0,
@@ -78,26 +73,30 @@ def ScoringModule(input_idx,input_name,chord_idx,chord_name,chord):
         score -= 100
     return score
 
-#print(key_chord_name_mapping)
-def NoteToChordFast(keys_name,key=None,numOut=10):
-  #result=[]
+def ScoredChords(keys_name,key=None):
+  # yields (score, chord) for every template containing all the input notes, in keychorddict order
   keys_idx=keys2num(keys_name)
-  sorted_keys = sorted(keys_idx)
-  #print(keys)
-  # for i in range(threshold,5):
-  #   for each in itertools.combinations(keys,i):
-  #     print(each)
-  #     result.extend(key_chord_name_mapping[str(each)])
-  chords = key_chord_name_mapping[str(tuple(sorted_keys))]
-  chords2 = chords.copy()
-  score = []
-  for r in chords:
-    entry = data[r]
-    if key is not None and entry["key"].upper() != key.upper():
-      chords2.remove(r)
+  if key is not None:
+    key=key.upper()
+  for r in store.mask_table[notesToMask(keys_idx)]:
+    entry = store.data[r]
+    if key is not None and entry["key"] != key:
       continue
-    score.append(ScoringModule(keys_idx,keys_name,entry["idx"],entry["naming"],entry["chord"]))
-  df = pd.DataFrame({"Chord":chords2,"Score":score})
+    yield ScoringModule(keys_idx,keys_name,entry["idx"],entry["naming"],entry["chord"]),r
+
+#print(key_chord_name_mapping)
+def NoteToChordFast(keys_name,key=None,numOut=10,quiet=False):
+  """
+      With quiet=True nothing is printed and pandas is not used: the top numOut chords are selected
+      with a heap and returned as a list of (chord, score) tuples, best first (ties keep keychorddict order).
+      Otherwise the ranking is printed as a DataFrame and the chord names are returned as before.
+  """
+  if quiet:
+    top = heapq.nlargest(numOut,ScoredChords(keys_name,key),key=itemgetter(0))
+    return [(r,score) for score,r in top]
+  scored = list(ScoredChords(keys_name,key))
+  import pandas as pd  # only needed for this printed report, keep it off the import path
+  df = pd.DataFrame({"Chord":[r for _,r in scored],"Score":[score for score,_ in scored]})
   df = df.sort_values("Score",ascending=False)
   print("The most likely chords are:")
   print(df.head(numOut))
@@ -119,11 +118,12 @@ if __name__ == "__main__":
     parser.add_argument("notes", nargs='+',help='The input keys (3 or 4 notes)')
     parser.add_argument("-o",'--numout',type=int,help='Number of output (optional)')
     parser.add_argument("-k","--key",help="The key (optional)")
+    parser.add_argument("-q","--quiet",action="store_true",help="Skip the DataFrame report and print (chord, score) records")
     args = parser.parse_args()
     start = time.time()
-    if args.numout is not None:
-        NoteToChordFast(args.notes,args.key,args.numout)
-    else:
-        NoteToChordFast(args.notes,args.key)
+    numout = args.numout if args.numout is not None else 10
+    result = NoteToChordFast(args.notes,args.key,numout,args.quiet)
+    if args.quiet:
+        print(result)
     end = time.time()
     print("Time taken:",end-start)
\ No newline at end of file
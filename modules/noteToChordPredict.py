@@ -1,8 +1,10 @@
 from noteToChordWeighted import NoteToChord
+from chordTemplateStore import module_dir
 import json
+import os
 import numpy as np
 
-with open("../data/training_data2.json", "r") as f:
+with open(os.path.join(module_dir, "..", "data", "training_data2.json"), "r") as f:
     data = json.load(f)
 
 ##PROVIDED KEY VERSION
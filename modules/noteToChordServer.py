@@ -0,0 +1,320 @@
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import os
+import signal
+import socket
+import tempfile
+import time
+from collections import defaultdict, deque
+import numpy as np
+import noteToChord
+import noteToChordWeighted
+from chordToNote import ChordToNote, compileChordTable
+from chordTemplateStore import store
+
+# Long running note/chord server: one process keeps the templates resident and answers
+# newline-delimited JSON requests over a Unix socket (or localhost TCP with --port).
+#
+# Every request is a JSON object with an "op" field and one response line comes back per request:
+#   {"op": "noteToChord", "notes": ["C", "E", "G"], "key": "CMajor", "numOut": 3, "threshold": 2}
+#   {"op": "weighted", "notes": {"C": 0.5, "E": 0.3, "G": 0.2}, "key": "CMajor"}
+#   {"op": "chroma", "weights": [12 floats], "key": "CMajor", "numOut": 3}
+#   {"op": "chordToNote", "key": "CMajor", "chord": "V7"}
+#   {"op": "stats"}
+# Any query op also accepts "queries": [...] (a list of the per-query fields) and answers with a list.
+# Concurrent "chroma" queries, including the items of batched requests, are coalesced and scored
+# together by noteToChordWeighted.NoteToChordBatch.
+
+default_socket = os.path.join(tempfile.gettempdir(), "noteToChord.sock")
+# batched requests easily exceed asyncio's 64 KiB default line limit
+line_limit = 1 << 24
+
+
+class LatencyStats:
+    """
+        Keeps the last `window` request latencies of every op and reports their percentiles in ms.
+    """
+
+    def __init__(self, window=10000):
+        self.samples = defaultdict(lambda: deque(maxlen=window))
+        self.counts = defaultdict(int)
+
+    def record(self, op, seconds):
+        self.samples[op].append(seconds * 1000)
+        self.counts[op] += 1
+
+    def report(self):
+        result = {}
+        for op, samples in self.samples.items():
+            p50, p90, p99 = np.percentile(np.array(samples), [50, 90, 99])
+            result[op] = {
+                "count": self.counts[op],
+                "p50 ms": float(p50),
+                "p90 ms": float(p90),
+                "p99 ms": float(p99),
+                "max ms": float(max(samples)),
+            }
+        return result
+
+
+class ChromaBatcher:
+    """
+        Collects chroma queries for up to `window` seconds (or `maxBatch` queries) and scores them
+        with one NoteToChordBatch call per (numOut, threshold) group.
+    """
+
+    def __init__(self, window=0.002, maxBatch=256):
+        self.window = window
+        self.maxBatch = maxBatch
+        self.pending = []
+        self.flushHandle = None
+        self.batchSizes = deque(maxlen=10000)
+
+    def submit(self, weights, key, numOut, threshold):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self.pending.append((weights, key, numOut, threshold, future))
+        if len(self.pending) >= self.maxBatch:
+            self.flush()
+        elif self.flushHandle is None:
+            self.flushHandle = loop.call_later(self.window, self.flush)
+        return future
+
+    def flush(self):
+        if self.flushHandle is not None:
+            self.flushHandle.cancel()
+            self.flushHandle = None
+        pending, self.pending = self.pending, []
+        if not pending:
+            return
+        self.batchSizes.append(len(pending))
+        groups = defaultdict(list)
+        for item in pending:
+            groups[(item[2], item[3])].append(item)
+        for (numOut, threshold), items in groups.items():
+            try:
+                chords, scores = noteToChordWeighted.NoteToChordBatch(
+                    np.array([item[0] for item in items], dtype=float),
+                    [item[1] for item in items],
+                    numOut,
+                    threshold,
+                )
+            except Exception as e:
+                for item in items:
+                    if not item[4].done():
+                        item[4].set_exception(e)
+                continue
+            for row, item in enumerate(items):
+                result = []
+                for chord, score in zip(chords[row], scores[row]):
+                    if chord is None:
+                        break
+                    # single note rows carry no score, like the scalar NoteToChord
+                    result.append(
+                        {"Chord": chord}
+                        if np.isnan(score)
+                        else {"Chord": chord, "Score": float(score)}
+                    )
+                if not item[4].done():
+                    item[4].set_result(result if result else None)
+
+
+class NoteToChordServer:
+    def __init__(self, window=0.002, maxBatch=256):
+        self.batcher = ChromaBatcher(window, maxBatch)
+        self.latency = LatencyStats()
+        # touch everything once so the first request does not pay for loading
+        store.mask_table
+        compileChordTable()
+
+    async def answer(self, op, query):
+        if op == "noteToChord":
+            return noteToChord.NoteToChord(
+                query["notes"],
+                query.get("key"),
+                query.get("numOut", 10),
+                query.get("threshold", 2),
+            )
+        elif op == "weighted":
+            return noteToChordWeighted.NoteToChord(
+                query["notes"],
+                query.get("key"),
+                query.get("numOut", 10),
+                query.get("threshold", 2),
+            )
+        elif op == "chroma":
+            weights = query["weights"]
+            if len(weights) != 12:
+                raise ValueError("chroma weights must have 12 entries")
+            return await self.batcher.submit(
+                weights,
+                query.get("key"),
+                query.get("numOut", 10),
+                query.get("threshold", 2),
+            )
+        elif op == "chordToNote":
+            try:
+                # it prints "Wrong input format." before exiting; keep that out of the server log, the error response says it
+                with contextlib.redirect_stdout(io.StringIO()):
+                    notes, names = ChordToNote(query["key"], query["chord"])
+            except SystemExit:
+                # computeChordToNote exits the process on malformed input
+                raise ValueError(
+                    "invalid chord %r in key %r" % (query["chord"], query["key"])
+                )
+            return {"idx": notes, "naming": names}
+        raise ValueError("unknown op %r" % op)
+
+    async def answerSafely(self, op, query):
+        try:
+            return {"result": await self.answer(op, query)}
+        except Exception as e:
+            return {"error": "%s: %s" % (type(e).__name__, e)}
+
+    async def handle(self, request):
+        op = request.get("op")
+        if op == "stats":
+            sizes = self.batcher.batchSizes
+            return {
+                "latency": self.latency.report(),
+                "mean chroma batch": float(np.mean(sizes)) if sizes else 0.0,
+                "weighted cache": noteToChordWeighted.cacheStats(),
+            }
+        start = time.perf_counter()
+        if "queries" in request:
+            response = await asyncio.gather(
+                *[self.answerSafely(op, query) for query in request["queries"]]
+            )
+        else:
+            response = await self.answerSafely(op, request)
+        self.latency.record(op, time.perf_counter() - start)
+        return response
+
+    async def respond(self, line, writer, previous):
+        try:
+            response = await self.handle(json.loads(line))
+        except Exception as e:
+            response = {"error": "%s: %s" % (type(e).__name__, e)}
+        # answers are computed concurrently but written in request order
+        if previous is not None:
+            await previous
+        writer.write((json.dumps(response) + "\n").encode())
+
+    async def connection(self, reader, writer):
+        # requests on one connection are answered concurrently, so pipelined chroma queries get batched,
+        # and every response waits for the one before it: responses come back in request order
+        tasks = []
+        try:
+            while True:
+                try:
+                    line = await reader.readline()
+                except ValueError:
+                    writer.write(b'{"error": "request line too long"}\n')
+                    break
+                if not line:
+                    break
+                if line.strip():
+                    previous = tasks[-1] if tasks else None
+                    tasks.append(
+                        asyncio.ensure_future(self.respond(line, writer, previous))
+                    )
+            if tasks:
+                await asyncio.gather(*tasks)
+            await writer.drain()
+        finally:
+            writer.close()
+
+
+async def main(socketPath, port, window, maxBatch):
+    server = NoteToChordServer(window, maxBatch)
+    if port is not None:
+        listener = await asyncio.start_server(
+            server.connection, "127.0.0.1", port, limit=line_limit
+        )
+        print("Serving on 127.0.0.1:%d" % port)
+    else:
+        if os.path.exists(socketPath):
+            os.remove(socketPath)
+        listener = await asyncio.start_unix_server(
+            server.connection, socketPath, limit=line_limit
+        )
+        print("Serving on", socketPath)
+    stopped = asyncio.Event()
+    try:
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, stopped.set)
+    except NotImplementedError:
+        pass
+    try:
+        # Ctrl-C cancels this wait, the listener is closed either way
+        await stopped.wait()
+    finally:
+        listener.close()
+        await listener.wait_closed()
+        if port is None and os.path.exists(socketPath):
+            os.remove(socketPath)
+
+
+def serve(
+    socketPath=default_socket, port=None, window=0.002, maxBatch=256, cacheSize=0
+):
+    if cacheSize:
+        noteToChordWeighted.enableCache(cacheSize)
+    try:
+        asyncio.run(main(socketPath, port, window, maxBatch))
+    except KeyboardInterrupt:
+        pass
+
+
+def request(payload, socketPath=default_socket, port=None):
+    """
+        Blocking client: send one request (dict) and return the decoded response.
+    """
+    if port is not None:
+        conn = socket.create_connection(("127.0.0.1", port))
+    else:
+        conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        conn.connect(socketPath)
+    with conn:
+        conn.sendall((json.dumps(payload) + "\n").encode())
+        conn.shutdown(socket.SHUT_WR)
+        data = b""
+        while not data.endswith(b"\n"):
+            chunk = conn.recv(65536)
+            if not chunk:
+                break
+            data += chunk
+    return json.loads(data)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Serve note/chord queries from one process."
+    )
+    parser.add_argument(
+        "-s", "--socket", default=default_socket, help="Unix socket path (optional)"
+    )
+    parser.add_argument(
+        "-p", "--port", type=int, help="Listen on localhost TCP instead (optional)"
+    )
+    parser.add_argument(
+        "-w",
+        "--window",
+        type=float,
+        default=0.002,
+        help="Chroma batching window in seconds",
+    )
+    parser.add_argument(
+        "-b", "--maxbatch", type=int, default=256, help="Largest chroma batch"
+    )
+    parser.add_argument(
+        "-c",
+        "--cache",
+        type=int,
+        default=0,
+        help="Weighted query LRU cache size, 0 = off",
+    )
+    args = parser.parse_args()
+    serve(args.socket, args.port, args.window, args.maxbatch, args.cache)
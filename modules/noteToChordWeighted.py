@@ -1,17 +1,10 @@
-import json
-import pandas as pd
+import numpy as np
 import argparse
 import time
-import itertools
-from chordToNote import ChordToNote
-import pickle
-
-with open("../modules/json_files/keychorddict.json") as f:
-    data = json.load(f)
-with open("../modules/pickle_files/key_chord_name_mapping.pickle", "rb") as f:
-    key_chord_name_mapping = pickle.load(f)
-for k in data:
-    data[k]["key"] = data[k]["key"].upper()
+from collections import OrderedDict
+from chordToNote import index_to_pitch_sharp, index_to_pitch_flat, relative_major
+from chordMask import notesToMask, candidateChords
+from chordTemplateStore import store
 
 
 def intersection(a, b):
@@ -69,28 +62,33 @@ def ScoringModule(
     # score += 60 / (ed + 1)
     # if not length_match: #length match is not reliable when there are so many passing notes
     #     score -= 100
+    score += FunctionScore(chord, ismajor)
+    if hasSeventh:
+        score += 1
+    return score
+
+
+def FunctionScore(chord, ismajor):
     if ismajor:
         if chord in ["I"]:  # Tonic function chords
-            score += 5
+            return 5
         elif chord == "VI":
-            score += 4
+            return 4
         elif chord in ["IV", "II"]:  # Predominant function chords
-            score += 3
+            return 3
         elif chord in ["V", "VII", "DimVII"]:  # Dominant function chords
-            score += 2
+            return 2
     else:
         if chord in ["I", "VI"]:
-            score += 4
+            return 4
         elif chord in ["IV", "II"]:  # Predominant function chords
-            score += 3
+            return 3
         elif chord in ["V", "VII", "DimVII"]:  # Dominant function chords
-            score += 2
-    if hasSeventh:
-        score += 1
-    return score
+            return 2
+    return 0
 
 
-def MatchAnalysis(input_idx, input_name, chord_idx, chord_name, chord, key):
+def MatchAnalysis(input_idx, input_name, chord_idx, chord_name, seventhNote):
     idxMatch = intersection(input_idx, chord_idx)
     nameMatch = intersection(input_name, chord_name)
     if chord_name[0] in input_name:
@@ -102,9 +100,8 @@ def MatchAnalysis(input_idx, input_name, chord_idx, chord_name, chord, key):
         length_match = False
     else:
         length_match = True
-    seventhNote = ChordToNote(key, chord + "7")[-1]
+    # seventhNote is precomputed per (key, chord) by genJson.py and stored in keychorddict.json
     hasSeventh = seventhNote in input_name
-    # print(key, chord, seventhNote, input_name, hasSeventh)
     return len(idxMatch), len(nameMatch), root_match, ed, length_match, hasSeventh
 
 
@@ -151,20 +148,112 @@ minor_root_offset = [0, 2, 3, 5, 7, 8, 10]  # Defining (natural) minor scale as
 num_root_mapping = {1: "I", 2: "II", 3: "III", 4: "IV", 5: "V", 6: "VI", 7: "VII"}
 
 
+def normalizeNote(name):
+    # music21 style flats ("E-", "B--") to the "b" spelling used in keychorddict.json
+    if name[-2:] == "--":
+        return name[:-2] + "bb"
+    elif name[-1] == "-":
+        return name[:-1] + "b"
+    return name
+
+
+class QueryCache:
+    """
+        Bounded LRU cache of NoteToChord results.
+        A query is keyed on its canonical form: normalized note spellings in sorted order, weights rounded
+        to `precision` decimals, the key, numOut and threshold. Misses are computed on that canonical form,
+        so a cached answer is always the answer to the canonical query.
+    """
+
+    def __init__(self, maxsize=4096, precision=4):
+        self.maxsize = maxsize
+        self.precision = precision
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def canonical(self, keys_dict):
+        return tuple(
+            sorted(
+                (normalizeNote(note), round(float(w), self.precision))
+                for note, w in keys_dict.items()
+            )
+        )
+
+    def query(self, keys_dict, key, numOut, threshold):
+        notes = self.canonical(keys_dict)
+        cachekey = (notes, key, numOut, threshold)
+        if cachekey in self.entries:
+            self.hits += 1
+            self.entries.move_to_end(cachekey)
+            result = self.entries[cachekey]
+        else:
+            self.misses += 1
+            result = computeNoteToChord(dict(notes), key, numOut, threshold)
+            self.entries[cachekey] = result
+            if len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+        # rows are copied so callers can edit them without corrupting the cache
+        return None if result is None else [dict(row) for row in result]
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "size": len(self.entries),
+            "maxsize": self.maxsize,
+            "hit rate": self.hits / total if total else 0.0,
+        }
+
+    def clear(self):
+        self.entries.clear()
+        self.hits = self.misses = self.evictions = 0
+
+
+# opt-in, see enableCache()
+_cache = None
+
+
+def enableCache(maxsize=4096, precision=4):
+    """
+        Route NoteToChord through a QueryCache of at most maxsize queries (replacing any previous one).
+        Weights are rounded to `precision` decimals before lookup and scoring.
+    """
+    global _cache
+    _cache = QueryCache(maxsize, precision)
+    return _cache
+
+
+def disableCache():
+    global _cache
+    _cache = None
+
+
+def cacheStats():
+    return None if _cache is None else _cache.stats()
+
+
 def NoteToChord(keys_dict, key=None, numOut=10, threshold=2):
     """
         This is a weighted version.
         keys_dict will be a dictionary, notes as key, value as weight.
         Value should be normalized (add up to 1)
+        If enableCache() was called, repeated queries are served from the cache.
     """
+    if _cache is not None and len(keys_dict) > 0:
+        return _cache.query(keys_dict, key, numOut, threshold)
+    return computeNoteToChord(keys_dict, key, numOut, threshold)
+
+
+def computeNoteToChord(keys_dict, key=None, numOut=10, threshold=2):
     if len(keys_dict) == 0:
         return None
     elif len(keys_dict) == 1:
-        onlynote = list(keys_dict.keys())[0]
-        if onlynote[-2:] == "--":
-            onlynote = onlynote[:-2] + "bb"
-        elif onlynote[-1] == "-":
-            onlynote = onlynote[:-1] + "b"
+        onlynote = normalizeNote(list(keys_dict.keys())[0])
         if not key is None:
             note_idx = keys2num([onlynote])[0]
             key_idx = keys2num([key[:-5]])[0]
@@ -194,26 +283,10 @@ def NoteToChord(keys_dict, key=None, numOut=10, threshold=2):
         threshold = 2
     if key is not None:
         key = key.upper()
-    newkeydict = {}
-    for dictkey in keys_dict:
-        if dictkey[-2:] == "--":
-            newdictkey = dictkey[:-2] + "bb"
-            newkeydict[newdictkey] = keys_dict[dictkey]
-        elif dictkey[-1] == "-":
-            newdictkey = dictkey[:-1] + "b"
-            newkeydict[newdictkey] = keys_dict[dictkey]
-        else:
-            newkeydict[dictkey] = keys_dict[dictkey]
-    keys_dict = newkeydict
+    keys_dict = {normalizeNote(dictkey): keys_dict[dictkey] for dictkey in keys_dict}
     keys_name = list(keys_dict.keys())
     keys_idx = keys2num(keys_name)
-    sorted_keys = sorted(keys_idx)
-    possible_chords = set()
-    sorted_keys = sorted(list(set(keys_idx)))
-    for i in range(threshold, 5):
-        for each in itertools.combinations(sorted_keys, i):
-            possible_chords.update(key_chord_name_mapping[str(each)])
-    chords = list(possible_chords)
+    chords = list(candidateChords(store.mask_table, notesToMask(keys_idx), threshold))
     if chords == []:
         return None
     # print(chords)
@@ -229,7 +302,7 @@ def NoteToChord(keys_dict, key=None, numOut=10, threshold=2):
     if not key is None and key.upper() in changekey:
         key = changekey[key.upper()]
     for idx, chord in enumerate(chords):
-        entry = data[chord]
+        entry = store.data[chord]
         if (
             key is None or entry["key"] == key
         ):  ## remeber to make all key upper() after import**********\
@@ -245,12 +318,7 @@ def NoteToChord(keys_dict, key=None, numOut=10, threshold=2):
                 length_match,
                 isseventh,
             ) = MatchAnalysis(
-                keys_idx,
-                keys_name,
-                entry["idx"],
-                entry["naming"],
-                entry["chord"],
-                entry["key"],
+                keys_idx, keys_name, entry["idx"], entry["naming"], entry["seventh"]
             )
             score = ScoringModule(
                 keys_idx,
@@ -317,6 +385,177 @@ def NoteToChord(keys_dict, key=None, numOut=10, threshold=2):
     return result
 
 
+def keySpelling(key):
+    """
+        Names of the 12 pitch classes as spelt in the given key (same rule as chordToNote.noteNaming).
+        Used to turn a 12-dim chroma row back into the note names NoteToChord scores against.
+    """
+    if key is None:
+        key = "CMAJOR"
+    key = key.upper()
+    key = changekey.get(key, key)
+    isEbMinor = key == "EBMINOR"
+    if key[-5:] == "MINOR":
+        key = relative_major[key[:-5]] + "MAJOR"
+    if key in ["CMAJOR", "GMAJOR", "DMAJOR", "AMAJOR", "EMAJOR", "BMAJOR", "F#MAJOR"]:
+        spelling = [index_to_pitch_sharp[i] for i in range(12)]
+    else:
+        spelling = [index_to_pitch_flat[i] for i in range(12)]
+    if isEbMinor:
+        spelling[11] = "Cb"
+    return spelling
+
+
+def chromaToKeysDict(weights, key=None):
+    """
+        The keys_dict NoteToChord would receive for one chroma row: every pitch class with a positive weight,
+        spelt by keySpelling(key), in pitch class order.
+    """
+    spelling = keySpelling(key)
+    return {spelling[i]: float(w) for i, w in enumerate(weights) if w > 0}
+
+
+# per-key template matrices for NoteToChordBatch, built on first use
+_batch_templates = {}
+
+
+def batchTemplates(key):
+    if key in _batch_templates:
+        return _batch_templates[key]
+    spelling = keySpelling(key)
+    data = store.data
+    names = [chord for chord in data if key is None or data[chord]["key"] == key]
+    members = np.zeros((len(names), 12), dtype=bool)
+    nameMatch = np.zeros((len(names), 12), dtype=bool)
+    root = np.zeros(len(names), dtype=int)
+    rootNamed = np.zeros(len(names), dtype=bool)
+    seventh = np.zeros(len(names), dtype=int)
+    seventhNamed = np.zeros(len(names), dtype=bool)
+    bonus = np.zeros(len(names))
+    for c, chord in enumerate(names):
+        entry = data[chord]
+        members[c, entry["idx"]] = True
+        for p in range(12):
+            nameMatch[c, p] = spelling[p] in entry["naming"]
+        root[c] = entry["idx"][0]
+        rootNamed[c] = spelling[root[c]] == entry["naming"][0]
+        if entry["seventh"] in spelling:
+            seventh[c] = spelling.index(entry["seventh"])
+            seventhNamed[c] = True
+        bonus[c] = FunctionScore(
+            entry["chord"], entry["key"].upper().find("MAJOR") != -1
+        )
+    # NoteToChord breaks score ties by sorting chord names in reverse
+    nameRank = np.argsort(np.argsort(names))
+    templates = (
+        np.array(names, dtype=object),
+        members,
+        nameMatch,
+        root,
+        rootNamed,
+        seventh,
+        seventhNamed,
+        bonus,
+        nameRank,
+    )
+    _batch_templates[key] = templates
+    return templates
+
+
+def NoteToChordBatch(weights_matrix, keys, numOut=10, threshold=2):
+    """
+        Vectorized NoteToChord over N segments.
+        weights_matrix is an N x 12 array of pitch class weights, keys holds one key (or None) per row.
+        Row i is scored exactly as NoteToChord(chromaToKeysDict(weights_matrix[i], keys[i]), keys[i], numOut, threshold).
+        Returns (chords, scores): N x numOut arrays of chord names (object, None padded) and scores (NaN padded).
+        Rows for which NoteToChord returns None are left fully padded.
+    """
+    if numOut is None:
+        numOut = 10
+    if threshold is None:
+        threshold = 2
+    weights_matrix = np.asarray(weights_matrix, dtype=float)
+    n = weights_matrix.shape[0]
+    chords = np.full((n, numOut), None, dtype=object)
+    scores = np.full((n, numOut), np.nan)
+    present = weights_matrix > 0
+    numPresent = present.sum(axis=1)
+
+    groups = {}
+    for i, key in enumerate(keys):
+        if numPresent[i] == 1:
+            # single note rows take the scalar shortcut, which returns unscored chords
+            result = NoteToChord(
+                chromaToKeysDict(weights_matrix[i], key), key, numOut, threshold
+            )
+            if result is not None:
+                chords[i, : len(result)] = [r["Chord"] for r in result]
+            continue
+        if numPresent[i] == 0 or threshold > 4:
+            continue
+        if key is not None:
+            key = key.upper()
+            if key in changekey:
+                key = changekey[key]
+        groups.setdefault(key, []).append(i)
+
+    for key, rows in groups.items():
+        (
+            names,
+            members,
+            nameMatch,
+            root,
+            rootNamed,
+            seventh,
+            seventhNamed,
+            bonus,
+            nameRank,
+        ) = batchTemplates(key)
+        if len(names) == 0:
+            continue
+        rows = np.array(rows)
+        w = weights_matrix[rows]
+        has = present[rows]
+        score = np.zeros((len(rows), len(names)))
+        # accumulate in the same order as ScoringModule so that float ties break identically
+        for p in range(12):
+            hit = has[:, p : p + 1] & members[:, p]
+            score += np.where(hit, 100.0, 0.0)
+            score += np.where(hit, 100 * w[:, p : p + 1], 0.0)
+        for p in range(12):
+            hit = has[:, p : p + 1] & nameMatch[:, p]
+            score += np.where(hit, 1000.0, 0.0)
+            score += np.where(hit, 1000 * w[:, p : p + 1], 0.0)
+        rootWeight = w[:, root]
+        rootPresent = has[:, root] & rootNamed
+        minWeight = np.where(has, w, np.inf).min(axis=1, keepdims=True)
+        score += np.where(rootPresent, 500.0, 0.0)
+        score += np.where(rootPresent, 100 * rootWeight, 0.0)
+        score -= np.where(
+            rootPresent, np.where(rootWeight == minWeight, 50.0, 0.0), 100.0
+        )
+        score += bonus
+        score += np.where(has[:, seventh] & seventhNamed, 1.0, 0.0)
+
+        overlap = has.astype(int) @ members.T.astype(int)
+        valid = overlap >= threshold
+        order = np.lexsort(
+            (
+                -nameRank[np.newaxis, :].repeat(len(rows), 0),
+                -np.where(valid, score, -np.inf),
+            )
+        )
+        top = order[:, :numOut]
+        topValid = np.take_along_axis(valid, top, axis=1)
+        chords[rows[:, np.newaxis], np.arange(top.shape[1])] = np.where(
+            topValid, names[top], None
+        )
+        scores[rows[:, np.newaxis], np.arange(top.shape[1])] = np.where(
+            topValid, np.take_along_axis(score, top, axis=1), np.nan
+        )
+    return chords, scores
+
+
 if __name__ == "__main__":
     start = time.time()
     result = NoteToChord(